@@ -3,22 +3,97 @@ ScholarSwipe Backend - FastAPI Server
 Integrates with Perplexity Sonar API for academic paper search and summarization
 """
 #import libraries 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Optional, Tuple
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from datetime import date
+import asyncio
+import hashlib
+import heapq
+import hmac
+import itertools
+import json
+import logging
+import math
 import os
-from perplexity import Perplexity
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import httpx
+import numpy as np
+from perplexity import Perplexity, AsyncPerplexity, DefaultAsyncHttpxClient
+from perplexity import APIConnectionError, InternalServerError, RateLimitError
 import re
 
+logger = logging.getLogger("scholarswipe")
+
 # insert API key here generated from perplexity website 
 PERPLEXITY_API_KEY = "INSERT API KEY HERE"
 
-# Initialize client
-client = Perplexity(api_key=PERPLEXITY_API_KEY)
+# Initialize client (blocking; used when the async pool is not running)
+# Retries are handled by the upstream scheduler, not the SDK
+client = Perplexity(api_key=PERPLEXITY_API_KEY, max_retries=0)
+
+# Non-blocking client sharing one pooled HTTP connection set; created on app
+# startup and closed on shutdown (see lifespan below)
+async_client: Optional[AsyncPerplexity] = None
+
+# Upstream connection pool tuning
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("SCHOLARSWIPE_UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("SCHOLARSWIPE_UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("SCHOLARSWIPE_UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_TIMEOUT = float(os.getenv("SCHOLARSWIPE_UPSTREAM_TIMEOUT", "60"))
+
+# Per-paper summarization fan-out: how many papers are summarized at once and
+# how long a single paper may take before it falls back to the default summary
+SUMMARY_CONCURRENCY = int(os.getenv("SCHOLARSWIPE_SUMMARY_CONCURRENCY", "5"))
+SUMMARY_TIMEOUT = float(os.getenv("SCHOLARSWIPE_SUMMARY_TIMEOUT", "45"))
+
+# Papers packed into one sonar-pro request (1 = one request per paper). Larger
+# batches mean fewer round trips and prompt tokens but longer replies.
+SUMMARY_BATCH_SIZE = int(os.getenv("SCHOLARSWIPE_SUMMARY_BATCH_SIZE", "1"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Open the pooled async Perplexity client on startup (and start the
+    warm-up, if configured); close it on shutdown
+    """
+    global async_client
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(UPSTREAM_TIMEOUT, connect=5.0),
+    )
+    pooled_client = AsyncPerplexity(api_key=PERPLEXITY_API_KEY, http_client=http_client, max_retries=0)
+    async_client = pooled_client
+    warmup_task = None
+    if WARMUP_QUERIES_FILE:
+        with background_priority():
+            warmup_task = asyncio.ensure_future(warm_up(load_warmup_queries(WARMUP_QUERIES_FILE)))
+    try:
+        yield
+    finally:
+        if warmup_task is not None:
+            warmup_task.cancel()
+        for job in list(active_jobs.values()):
+            job.task.cancel()
+        async_client = None
+        await pooled_client.close()
 
 # Create FastAPI app
-app = FastAPI(title="ScholarSwipe API")
+app = FastAPI(title="ScholarSwipe API", lifespan=lifespan)
 
 # Allow frontend access
 app.add_middleware(
@@ -27,14 +102,101 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # The bibliography download names its file (and extension) in this header
+    expose_headers=["Content-Disposition"],
 )
 # check website state
 @app.get("/health")
 async def health_check():
     """Detailed health check"""
+    circuits = upstream.stats()
+    return {
+        "status": "degraded" if any(c["circuit"] == "open" for c in circuits.values()) else "healthy",
+        "perplexity_configured": bool(PERPLEXITY_API_KEY),
+        "upstream": circuits
+    }
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    """
+    Request counts, latency and in-flight gauge; optional Server-Timing
+    header. Upstream spend during the request is charged to its UsageScope.
+    """
+    timings: dict = {}
+    token = request_timings.set(timings)
+    usage_token = request_usage.set(UsageScope(client_id(request), request.url.path, asgi_scope=request.scope,
+                                               limit_key=client_limit_key(request)))
+    metrics.inc("scholarswipe_http_requests_in_flight")
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.inc("scholarswipe_http_requests_in_flight", value=-1)
+        request_timings.reset(token)
+        request_usage.reset(usage_token)
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        metrics.inc("scholarswipe_http_requests_total", {"method": request.method, "path": path, "status": str(status)})
+        metrics.observe("scholarswipe_http_request_seconds", elapsed, {"path": path})
+    if TIMING_HEADER:
+        stages = ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+        response.headers["Server-Timing"] = f"total;dur={elapsed * 1000:.1f}" + (f", {stages}" if stages else "")
+    return response
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus-style metrics"""
+    for cache in (search_cache, summary_cache):
+        metrics.set("scholarswipe_cache_lookups_total", cache.local_hits, {"cache": cache.name, "result": "hit", "tier": "local"})
+        metrics.set("scholarswipe_cache_lookups_total", cache.shared_hits, {"cache": cache.name, "result": "hit", "tier": "shared"})
+        metrics.set("scholarswipe_cache_lookups_total", cache.misses, {"cache": cache.name, "result": "miss", "tier": "all"})
+        metrics.set("scholarswipe_cache_entries", len(cache.local), {"cache": cache.name})
+    for model, stats in upstream.stats().items():
+        metrics.set("scholarswipe_circuit_open", 1 if stats["circuit"] == "open" else 0, {"model": model})
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters for both cache levels"""
+    return {
+        "search": search_cache.stats(),
+        "summary": summary_cache.stats(),
+        "shared_backend": CACHE_SQLITE_PATH or None
+    }
+
+@app.get("/usage")
+async def usage_report(request: Request, window: float = 86400, group_by: str = "model,stage", limit: int = 100):
+    """
+    Upstream calls, tokens and estimated cost over the last `window` seconds,
+    for capacity planning. `group_by` takes any of model, stage, endpoint,
+    query and user_id, comma-separated; groups come costliest first. Needs
+    X-Admin-Token once USAGE_ADMIN_TOKEN is set, and query/user_id need it set.
+    """
+    columns = [column.strip() for column in group_by.split(",") if column.strip()]
+    unknown = [column for column in columns if column not in USAGE_GROUP_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cannot group by {', '.join(unknown)}; use {', '.join(USAGE_GROUP_COLUMNS)}")
+    if USAGE_ADMIN_TOKEN:
+        if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), USAGE_ADMIN_TOKEN):
+            raise HTTPException(status_code=401, detail="X-Admin-Token required")
+    elif any(column in USAGE_PRIVATE_COLUMNS for column in columns):
+        raise HTTPException(status_code=403, detail="Grouping by query or user_id needs SCHOLARSWIPE_USAGE_ADMIN_TOKEN")
+    since = time.time() - max(0.0, window)
+
+    def report():
+        usage_ledger.purge(time.time() - USAGE_RETENTION)
+        return usage_ledger.aggregate(since, [])[0], usage_ledger.aggregate(since, columns, limit)
+
+    totals, groups = await asyncio.to_thread(report)
     return {
-        "status": "healthy",
-        "perplexity_configured": bool(PERPLEXITY_API_KEY)
+        "window": window,
+        "group_by": columns,
+        "totals": totals,
+        "groups": groups,
+        "budgets": {"request": REQUEST_BUDGET, "user": USER_BUDGET, "user_window": USER_BUDGET_WINDOW}
     }
 
 # Pydantic models for request/response validation
@@ -49,6 +211,9 @@ class PaperSummary(BaseModel):
     summary: str
     relevance_score: int
     authenticity_score: int
+    # True for the placeholder served when no real summary could be made;
+    # such summaries are never cached
+    fallback: bool = False
 
 class Paper(BaseModel):
     title: str
@@ -56,12 +221,20 @@ class Paper(BaseModel):
     snippet: Optional[str] = None
     abstract: Optional[str] = None
     summary: Optional[PaperSummary] = None
+    # True for demo papers or papers carrying a fallback summary
+    fallback: bool = False
 
 class SearchResponse(BaseModel):
     query: str
     papers: List[Paper]
     total_results: int
 
+class SessionResponse(BaseModel):
+    session_id: str
+    query: str
+    papers: List[Paper]
+    total_results: int
+
 class ConclusionRequest(BaseModel):
     papers: List[Paper]
 
@@ -69,28 +242,463 @@ class ConclusionResponse(BaseModel):
     conclusion: str
     total_papers: int
 
+# =====================
+# Metrics
+# =====================
+
+# Set SCHOLARSWIPE_TIMING_HEADER=1 to return per-stage timings on every response
+# in a Server-Timing header
+TIMING_HEADER = os.getenv("SCHOLARSWIPE_TIMING_HEADER", "0") == "1"
+
+# Stage durations of the request being handled, for the Server-Timing header
+request_timings: ContextVar[Optional[dict]] = ContextVar("request_timings", default=None)
+
+class Metrics:
+    """
+    Process-local counters, gauges and latency histograms, rendered in the
+    Prometheus text exposition format at /metrics.
+    """
+
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds: dict = {}
+        self._help: dict = {}
+        self._values: dict = {}
+        self._histograms: dict = {}
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._kinds[name] = kind
+        self._help[name] = help_text
+
+    @staticmethod
+    def _key(name: str, labels: Optional[dict]) -> tuple:
+        return name, tuple(sorted((labels or {}).items()))
+
+    def inc(self, name: str, labels: Optional[dict] = None, value: float = 1.0):
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, labels: Optional[dict] = None):
+        with self._lock:
+            self._values[self._key(name, labels)] = value
+
+    def observe(self, name: str, seconds: float, labels: Optional[dict] = None):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.BUCKETS), 0, 0.0]
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += 1
+            histogram[2] += seconds
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Time a pipeline stage into scholarswipe_stage_seconds and the request's timings"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("scholarswipe_stage_seconds", elapsed, {"stage": stage})
+            timings = request_timings.get()
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0.0) + elapsed
+
+    def get(self, name: str, labels: Optional[dict] = None) -> float:
+        return self._values.get(self._key(name, labels), 0.0)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            values = dict(self._values)
+            histograms = {k: (list(v[0]), v[1], v[2]) for k, v in self._histograms.items()}
+
+        names = sorted({k[0] for k in values} | {k[0] for k in histograms})
+        for name in names:
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {self._kinds[name]}")
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            for (metric, labels), (buckets, count, total) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, bucket_count in zip(self.BUCKETS, buckets):
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {bucket_count}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for k, v in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.6f}"
+
+metrics = Metrics()
+metrics.describe("scholarswipe_http_requests_total", "counter", "HTTP requests by method, route and status")
+metrics.describe("scholarswipe_http_request_seconds", "histogram", "HTTP request latency by route")
+metrics.describe("scholarswipe_http_requests_in_flight", "gauge", "HTTP requests currently being handled")
+metrics.describe("scholarswipe_upstream_calls_total", "counter", "Perplexity calls by model, stage and outcome")
+metrics.describe("scholarswipe_upstream_seconds", "histogram", "Perplexity call latency by model")
+metrics.describe("scholarswipe_stage_seconds", "histogram", "Time spent per pipeline stage")
+metrics.describe("scholarswipe_upstream_retries_total", "counter", "Upstream calls retried after a transient error, by model and error")
+metrics.describe("scholarswipe_circuit_open", "gauge", "1 while a model's circuit breaker is open")
+metrics.describe("scholarswipe_summary_repairs_total", "counter", "Follow-up calls for fields missing from a summary reply, by outcome")
+metrics.describe("scholarswipe_fallbacks_total", "counter", "Fallback results served instead of real ones")
+metrics.describe("scholarswipe_cache_lookups_total", "counter", "Cache lookups by cache, tier and result")
+metrics.describe("scholarswipe_cache_entries", "gauge", "Entries held in the in-process cache tier")
+metrics.describe("scholarswipe_shared_cache_errors_total", "counter", "Calls to the shared SQLite file (cache, rate limits) that failed and were skipped")
+metrics.describe("scholarswipe_title_resolution_total", "counter", "Generic titles resolved, by source (index, snippet, url_slug, llm, unresolved)")
+metrics.describe("scholarswipe_rerank_dropped_total", "counter", "Search candidates dropped by local re-ranking before summarization")
+metrics.describe("scholarswipe_paper_store_reuse_total", "counter", "Summaries rebuilt from the paper store with only a relevance rescore")
+metrics.describe("scholarswipe_singleflight_total", "counter", "Coalesced lookups: leaders start upstream work, followers share it")
+metrics.describe("scholarswipe_upstream_tokens_total", "counter", "Perplexity tokens by model, stage and kind (prompt, completion)")
+metrics.describe("scholarswipe_upstream_cost_usd_total", "counter", "Estimated Perplexity spend in USD by model and stage")
+metrics.describe("scholarswipe_budget_degradations_total", "counter", "Cheaper paths taken because a budget ran low, by action")
+metrics.describe("scholarswipe_budget_exceeded_total", "counter", "Upstream calls refused because a budget was spent, by budget (request, user)")
+
+# =====================
+# Response cache
+# =====================
+
+# Level 1 maps a normalized query to the search_papers() result, level 2 maps
+# (paper URL, normalized query) to its PaperSummary. Both live in process and,
+# when SCHOLARSWIPE_CACHE_SQLITE_PATH is set, in a SQLite file shared between
+# processes.
+SEARCH_CACHE_TTL = float(os.getenv("SCHOLARSWIPE_SEARCH_CACHE_TTL", "3600"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SCHOLARSWIPE_SEARCH_CACHE_MAX_ENTRIES", "512"))
+SUMMARY_CACHE_TTL = float(os.getenv("SCHOLARSWIPE_SUMMARY_CACHE_TTL", "86400"))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SCHOLARSWIPE_SUMMARY_CACHE_MAX_ENTRIES", "5000"))
+CACHE_SQLITE_PATH = os.getenv("SCHOLARSWIPE_CACHE_SQLITE_PATH", "")
+# Seconds the shared SQLite file is skipped after a call to it failed (e.g.
+# locked): the cache tier is treated as a miss, rate limits as per process
+SHARED_CACHE_RETRY = float(os.getenv("SCHOLARSWIPE_SHARED_CACHE_RETRY", "30"))
+
+class TTLCache:
+    """In-process LRU cache whose entries expire ttl seconds after being set"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class SQLiteCache:
+    """
+    Shared cache backend in a local SQLite file. Values are stored as JSON,
+    so any process (or test) pointing at the same file sees the same entries.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        # time.monotonic() until which shared_cache_call() skips this cache
+        self.unavailable_until = 0.0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, accessed_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+
+    def get(self, namespace: str, key: str):
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+                return None
+            self._conn.execute(
+                "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, namespace, key)
+            )
+        return json.loads(row[0])
+
+    def set(self, namespace: str, key: str, value, ttl: float):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), now + ttl, now)
+            )
+            # Size bound per namespace: drop expired rows, then least recently used
+            self._conn.execute("DELETE FROM cache WHERE namespace = ? AND expires_at < ?", (namespace, now))
+            self._conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND key IN ("
+                " SELECT key FROM cache WHERE namespace = ?"
+                " ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (namespace, namespace, self.max_entries)
+            )
+
+    def delete(self, namespace: str, key: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+async def shared_cache_call(cache: SQLiteCache, method: str, *args):
+    """
+    Run a SQLiteCache method in a worker thread, so a locked file never
+    stalls the event loop. A failure is a miss (or a skipped write): None,
+    and the cache is then skipped for SHARED_CACHE_RETRY seconds rather than
+    waited on again by every call.
+    """
+    if time.monotonic() < cache.unavailable_until:
+        return None
+    try:
+        return await asyncio.to_thread(getattr(cache, method), *args)
+    except sqlite3.Error as e:
+        cache.unavailable_until = time.monotonic() + SHARED_CACHE_RETRY
+        logger.warning(f"Shared cache unavailable ({cache.path}), skipping it for {SHARED_CACHE_RETRY:.0f}s: {e}")
+        metrics.inc("scholarswipe_shared_cache_errors_total")
+        return None
+
+class ResponseCache:
+    """
+    One cache level: an in-process TTLCache in front of an optional shared
+    backend. Values must be JSON-serializable. Hits and misses are counted
+    per tier so the cache can be sized from /cache/stats.
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl: float, shared: Optional[SQLiteCache] = None):
+        self.name = name
+        self.ttl = ttl
+        self.local = TTLCache(max_entries, ttl)
+        self.shared = shared
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    async def get(self, key: str):
+        value = self.local.get(key)
+        if value is not None:
+            self.local_hits += 1
+            return value
+        if self.shared is not None:
+            value = await shared_cache_call(self.shared, "get", self.name, key)
+            if value is not None:
+                self.shared_hits += 1
+                self.local.set(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            await shared_cache_call(self.shared, "set", self.name, key, value, self.ttl)
+
+    async def delete(self, key: str):
+        self.local.delete(key)
+        if self.shared is not None:
+            await shared_cache_call(self.shared, "delete", self.name, key)
+
+    def stats(self) -> dict:
+        lookups = self.local_hits + self.shared_hits + self.misses
+        hits = self.local_hits + self.shared_hits
+        return {
+            "entries": len(self.local),
+            "local_hits": self.local_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+_NON_WORD_RE = re.compile(r'[^\w\s]+')
+
+def normalize_query(query: str) -> str:
+    """Normalize a query so trivially different spellings share a cache entry"""
+    return ' '.join(_NON_WORD_RE.sub(' ', query.lower()).split())
+
+shared_cache = SQLiteCache(CACHE_SQLITE_PATH, max(SEARCH_CACHE_MAX_ENTRIES, SUMMARY_CACHE_MAX_ENTRIES)) if CACHE_SQLITE_PATH else None
+search_cache = ResponseCache("search", SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_TTL, shared_cache)
+summary_cache = ResponseCache("summary", SUMMARY_CACHE_MAX_ENTRIES, SUMMARY_CACHE_TTL, shared_cache)
+
+def summary_cache_key(paper: dict, query: str) -> str:
+    # URL variants of the same paper (abs/pdf, tracking parameters) share a key
+    return f"{canonical_paper_id(paper.get('url', ''))}\n{normalize_query(query)}"
+
+# =====================
+# Request coalescing
+# =====================
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical work. The first caller for a key starts
+    the work as its own task; callers arriving while it runs await that same
+    task instead of starting another. A caller that is cancelled only stops
+    waiting, and the work itself is cancelled once nobody is waiting for it.
+    The key is released as soon as the work finishes, so an error is seen
+    by the callers that shared it but never by later ones.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: dict = {}
+        self._waiters: dict = {}
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: str, work: Callable[[], Awaitable]):
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._start(key, work)
+        else:
+            metrics.inc("scholarswipe_singleflight_total", {"flight": self.name, "role": "follower"})
+        return await self._wait(key, task)
+
+    async def do_many(self, keys: List[str], work: Callable[[List[str]], Awaitable[list]]) -> list:
+        """
+        do() for several keys at once, results in the order of `keys`. The
+        keys nobody is working on yet go to ONE call of work(led_keys), which
+        returns their results in order; each of them is registered on its own,
+        so later callers (do() or do_many()) join it key by key. Keys already
+        in flight join that work. The shared call is cancelled once none of
+        its keys is awaited any more.
+        """
+        tasks = {}
+        for key in dict.fromkeys(keys):
+            if key in self._inflight:
+                tasks[key] = self._inflight[key]
+                metrics.inc("scholarswipe_singleflight_total", {"flight": self.name, "role": "follower"})
+        led = [key for key in dict.fromkeys(keys) if key not in tasks]
+        if led:
+            batch = asyncio.ensure_future(work(led))
+            # Mark the error as seen even if every key was cancelled
+            batch.add_done_callback(lambda done: done.cancelled() or done.exception())
+            pending = [len(led)]
+
+            def finished(_):
+                pending[0] -= 1
+                if not pending[0] and not batch.done():
+                    batch.cancel()
+
+            async def pick(position: int):
+                return (await asyncio.shield(batch))[position]
+
+            for position, key in enumerate(led):
+                tasks[key] = self._start(key, lambda position=position: pick(position))
+                tasks[key].add_done_callback(finished)
+        return list(await asyncio.gather(*(self._wait(key, tasks[key]) for key in keys)))
+
+    def _start(self, key: str, work: Callable[[], Awaitable]) -> asyncio.Future:
+        task = asyncio.ensure_future(work())
+        self._inflight[key] = task
+        self._waiters[key] = 0
+        task.add_done_callback(lambda done, key=key: self._release(key, done))
+        metrics.inc("scholarswipe_singleflight_total", {"flight": self.name, "role": "leader"})
+        return task
+
+    async def _wait(self, key: str, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and self._waiters.get(key) == 1 and self._inflight.get(key) is task:
+                task.cancel()
+            raise
+        finally:
+            if self._inflight.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _release(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            del self._waiters[key]
+        # Mark the error as seen even if every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
+
+search_flight = SingleFlight("search")
+summary_flight = SingleFlight("summary")
+
 # =====================
 # Helper functions
 # =====================
 
+# Compiled once; clean_title() and extract_title_from_url() run per paper
+_TITLE_PREFIX_RE = re.compile(r'^(Title:|Paper:|Article:)\s*', re.IGNORECASE)
+_TITLE_EXTENSION_RE = re.compile(r'\.(pdf|html|htm)$', re.IGNORECASE)
+_UNDERSCORE_RUN_RE = re.compile(r'[_]{2,}')
+_DASH_RUN_RE = re.compile(r'[-]{3,}')
+_URL_EXTENSION_RE = re.compile(r'\.(pdf|html|htm).*$', re.IGNORECASE)
+
 def clean_title(title: str) -> str:
     """Clean and format a title properly"""
     if not title:
         return "Research Paper"
     
     # Remove common prefixes
-    title = re.sub(r'^(Title:|Paper:|Article:)\s*', '', title, flags=re.IGNORECASE)
+    if ':' in title:
+        title = _TITLE_PREFIX_RE.sub('', title)
     
     # Remove URLs if accidentally included
     if title.startswith('http'):
         return "Research Paper"
     
     # Remove file extensions
-    title = re.sub(r'\.(pdf|html|htm)$', '', title, flags=re.IGNORECASE)
+    if '.' in title:
+        title = _TITLE_EXTENSION_RE.sub('', title)
     
-    # Remove excessive punctuation
-    title = re.sub(r'[_]{2,}', ' ', title)
-    title = re.sub(r'[-]{3,}', ' ', title)
+    # Remove excessive punctuation (the substring checks skip the regexes for most titles)
+    if '__' in title:
+        title = _UNDERSCORE_RUN_RE.sub(' ', title)
+    if '---' in title:
+        title = _DASH_RUN_RE.sub(' ', title)
     
     # Clean up whitespace
     title = ' '.join(title.split())
@@ -108,16 +716,20 @@ def clean_title(title: str) -> str:
 def extract_title_from_url(url: str) -> str:
     """Extract a reasonable title from URL as last resort"""
     try:
-        # Get the last meaningful part of the URL
+        # Get the last meaningful part of the URL path (never the domain)
         parts = url.rstrip('/').split('/')
+        if '://' in url:
+            parts = parts[3:]
         
         # Try to find a meaningful part (usually the last segment)
         for part in reversed(parts):
-            if len(part) > 15 and not part.startswith(('http', 'www')):
+            # Skip identifiers such as arXiv ids or article numbers
+            is_identifier = sum(c.isdigit() for c in part) > len(part) * 0.3
+            if len(part) > 15 and not part.startswith(('http', 'www')) and not is_identifier:
                 # Replace common URL separators with spaces
                 title = part.replace('-', ' ').replace('_', ' ')
                 # Remove file extensions
-                title = re.sub(r'\.(pdf|html|htm).*$', '', title, flags=re.IGNORECASE)
+                title = _URL_EXTENSION_RE.sub('', title)
                 # Remove query parameters
                 title = title.split('?')[0]
                 # Capitalize
@@ -129,270 +741,2756 @@ def extract_title_from_url(url: str) -> str:
     except:
         return "Research Paper"
 
-def search_papers(query: str) -> List[dict]:
+# =====================
+# Local relevance ranking
+# =====================
+
+# Sonar is asked for SEARCH_CANDIDATES papers; a BM25 score over each
+# candidate's title and snippet picks the RERANK_TOP_N worth summarizing
+SEARCH_CANDIDATES = int(os.getenv("SCHOLARSWIPE_SEARCH_CANDIDATES", "20"))
+RERANK_TOP_N = int(os.getenv("SCHOLARSWIPE_RERANK_TOP_N", "10"))
+# Candidates scoring below this fraction of the best candidate are dropped
+RERANK_MIN_SCORE = float(os.getenv("SCHOLARSWIPE_RERANK_MIN_SCORE", "0.15"))
+# Title terms count this many times over snippet terms
+RERANK_TITLE_WEIGHT = int(os.getenv("SCHOLARSWIPE_RERANK_TITLE_WEIGHT", "2"))
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'how', 'in',
+    'into', 'is', 'it', 'its', 'of', 'on', 'or', 'that', 'the', 'their', 'this',
+    'to', 'using', 'via', 'what', 'with', 'paper', 'papers', 'research', 'study',
+    'recent', 'new', 'about'
+}
+
+def rank_terms(text: str) -> List[str]:
+    """Lowercased, stopword-free terms with a light plural strip"""
+    terms = []
+    for word in normalize_query(text).split():
+        if word in STOPWORDS or len(word) < 2:
+            continue
+        if len(word) > 4 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+class RelevanceRanker:
     """
-    Search for academic papers using Perplexity Sonar Search API.
-    Enhanced title extraction.
+    Okapi BM25 over the title and snippet of a candidate set, vectorized with
+    NumPy. The candidates themselves are the corpus, so IDF rewards query
+    terms that separate papers from each other.
     """
-    try:
-        search_query = f"""Find recent academic research papers about: {query}
 
-Focus on papers from trusted sources like:
-- arxiv.org
-- nature.com
-- science.org
-- ieee.org
-- acm.org
-- springer.com
-- scholar.google.com
+    def __init__(self, k1: float = 1.2, b: float = 0.75, title_weight: int = 2):
+        self.k1 = k1
+        self.b = b
+        self.title_weight = title_weight
 
-For each paper found, provide in this exact format:
+    def scores(self, papers: List[dict], query: str) -> np.ndarray:
+        query_terms = list(dict.fromkeys(rank_terms(query)))
+        if not papers or not query_terms:
+            return np.zeros(len(papers))
+        column = {term: j for j, term in enumerate(query_terms)}
 
-Title: [ACTUAL PAPER TITLE FROM THE SOURCE]
-URL: [full URL to the paper]
-Description: [2-3 sentence description]
+        tf = np.zeros((len(papers), len(query_terms)))
+        lengths = np.zeros(len(papers))
+        for i, paper in enumerate(papers):
+            terms = rank_terms(paper.get('title', '')) * self.title_weight + rank_terms(paper.get('snippet') or '')
+            lengths[i] = len(terms)
+            for term in terms:
+                j = column.get(term)
+                if j is not None:
+                    tf[i, j] += 1
 
-CRITICAL INSTRUCTIONS:
-1. Use the ACTUAL TITLE from the paper (not the URL, not "Research Paper")
-2. Look for the title in the page metadata, header, or citation
-3. Each title should be descriptive and specific to the paper's content
-4. Format each paper entry clearly with Title, URL, and Description labels
+        df = np.count_nonzero(tf, axis=0)
+        idf = np.log1p((len(papers) - df + 0.5) / (df + 0.5))
+        norm = self.k1 * (1 - self.b + self.b * lengths / max(lengths.mean(), 1.0))
+        return (tf * (self.k1 + 1) / (tf + norm[:, None]) * idf).sum(axis=1)
 
-Provide at least 10 relevant papers."""
+    def rank(self, papers: List[dict], query: str, top_n: int, min_score: float) -> List[dict]:
+        """
+        Best top_n papers, best first, without those scoring under min_score
+        of the best. Ties keep Sonar's order; with no term overlap at all the
+        candidates are returned unfiltered.
+        """
+        scores = self.scores(papers, query)
+        best = scores.max() if len(scores) else 0.0
+        if best <= 0:
+            return papers[:top_n]
+        order = np.argsort(-scores, kind='stable')
+        keep = [int(i) for i in order if scores[i] >= min_score * best][:top_n]
+        metrics.inc("scholarswipe_rerank_dropped_total", value=len(papers) - len(keep))
+        return [papers[i] for i in keep]
 
-        # call Sonar model
-        response = client.chat.completions.create(
-            model="sonar",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an academic research assistant. Find relevant peer-reviewed papers and provide their EXACT TITLES as they appear on the source page, full URLs, and brief descriptions. Never use generic names like 'Research Paper' or URLs as titles. Always extract the real paper title."
-                },
-                {
-                    "role": "user",
-                    "content": search_query
-                }
-            ]
-        )
+relevance_ranker = RelevanceRanker(title_weight=RERANK_TITLE_WEIGHT)
 
-        response_text = ""
-        try:
-            response_text = response.choices[0].message.content if hasattr(response, "choices") else str(response)
-        except Exception:
-            response_text = str(response)
+# =====================
+# Sonar response parsing
+# =====================
 
-        # Attempt to extract structured citations
-        raw_citations = None
-        if hasattr(response, "citations"):
-            raw_citations = response.citations
+class SonarResponseParser:
+    """
+    Turns a Sonar search reply into paper records ({"title", "url", "snippet"}).
+
+    The reply text is tokenized in one linear pass over its lines: a single
+    precompiled pattern recognizes "Title:", "URL:" and "Description:" labels
+    at the start of a line (after list numbers or markdown), and unlabeled
+    lines continue the current description up to a blank line. Labels are
+    grouped into records in order, so a title always belongs to the URL that
+    follows it. Records are merged with the structured citations through a
+    URL-keyed dict.
+    """
+
+    LINE_LABEL_RE = re.compile(r'[\s*_\-#>\d.)]*(title|url|description)[*_]*\s*:[*_]*\s*(.*)', re.IGNORECASE)
+    # A further label on the same line, as in "Title: ... URL: ... Description: ..."
+    INLINE_LABEL_RE = re.compile(r'[*_]*\b(url|description)[*_]*\s*:[*_]*\s*', re.IGNORECASE)
+    # [text](url), allowing balanced parentheses inside the URL as in .../Foo_(bar)
+    MARKDOWN_LINK_RE = re.compile(r'\]\((https?://(?:[^()\s]|\([^()\s]*\))+)\)')
+    URL_RE = re.compile(r'https?://[^\s<>\[\]"]+')
+    # Markdown emphasis or list markers left around a value
+    DECORATION_CHARS = ' \t*_-#>'
+    # Punctuation that ends the sentence rather than the URL; ")" only when unbalanced
+    URL_TRAILING_CHARS = '.,;:>*"\''
+
+    def __init__(self, max_papers: Optional[int] = 12, snippet_length: int = 200):
+        self.max_papers = max_papers
+        self.snippet_length = snippet_length
+
+    def tokenize(self, text: str) -> List[dict]:
+        """Single pass over the reply text producing (title, url, description) records"""
+        records: List[dict] = []
+        current: dict = {}
+        in_description = False
+
+        for line in text.splitlines():
+            if not line:
+                in_description = False
+                continue
+            match = self.LINE_LABEL_RE.match(line)
+            if match is None:
+                if in_description:
+                    line = line.strip()
+                    if line:
+                        current['description'] += ' ' + line
+                    else:
+                        in_description = False
+                continue
+
+            if self.max_papers is not None and len(records) >= self.max_papers:
+                break
+            current, in_description = self._add_label(records, current, match.group(1).lower(), match.group(2))
+
+        if current:
+            records.append(current)
+        return [r for r in records if r.get('url')]
+
+    def _add_label(self, records: List[dict], current: dict, label: str, value: str) -> Tuple[dict, bool]:
+        """
+        Apply one labelled value, then any label later on the same line.
+        Returns the current record and whether its description may continue.
+        """
+        if label == 'description':
+            current['description'] = value.strip(self.DECORATION_CHARS)
+            return current, True
+        inline = self.INLINE_LABEL_RE.search(value) if ':' in value else None
+        own = value[:inline.start()] if inline else value
+        if label == 'title':
+            if current:
+                records.append(current)
+            current = {'title': own.strip(self.DECORATION_CHARS)}
         else:
-            try:
-                maybe = getattr(response.choices[0].message, "citations", None)
-                if maybe:
-                    raw_citations = maybe
-            except Exception:
-                raw_citations = None
+            current = self._add_url(records, current, own)
+        if inline:
+            return self._add_label(records, current, inline.group(1).lower(), value[inline.end():])
+        return current, False
 
-        papers = []
-
-        if raw_citations:
-            for c in raw_citations[:12]:
-                title = "Research Paper"
-                url = ""
-                snippet = ""
-                
-                if isinstance(c, dict):
-                    title = c.get("title") or c.get("name") or ""
-                    url = c.get("url") or c.get("link") or ""
-                    snippet = c.get("text") or c.get("snippet") or c.get("description") or ""
-                elif isinstance(c, str):
-                    url = c
-                else:
-                    try:
-                        url = str(c)
-                    except Exception:
-                        url = ""
-                
-                # Clean and validate title
-                if title and title != "Research Paper":
-                    title = clean_title(title)
-                
-                # If still generic, try to extract from URL
-                if title == "Research Paper" and url:
-                    title = extract_title_from_url(url)
-                
-                papers.append({"title": title, "url": url, "snippet": snippet})
-        
-        # Parse text response for better title extraction
-        if response_text:
-            # Try to find "Title:" patterns
-            title_pattern = r'Title:\s*(.+?)(?:\n|URL:|$)'
-            url_pattern = r'URL:\s*(https?://[^\s\n]+)'
-            
-            titles = re.findall(title_pattern, response_text, re.IGNORECASE | re.MULTILINE)
-            urls = re.findall(url_pattern, response_text, re.IGNORECASE | re.MULTILINE)
-            
-            # Match titles with URLs
-            for i, url in enumerate(urls[:12]):
-                title = titles[i] if i < len(titles) else extract_title_from_url(url)
+    def _add_url(self, records: List[dict], current: dict, value: str) -> dict:
+        link = self.MARKDOWN_LINK_RE.search(value) if '](' in value else None
+        if link:
+            url = link.group(1)
+        else:
+            url_match = self.URL_RE.search(value)
+            if not url_match:
+                return current
+            url = self.trim_url(url_match.group(0))
+        if 'url' in current:
+            records.append(current)
+            current = {}
+        current['url'] = url
+        return current
+
+    @classmethod
+    def trim_url(cls, url: str) -> str:
+        """Drop trailing punctuation, keeping a closing ")" that the URL itself opened"""
+        url = url.rstrip(cls.URL_TRAILING_CHARS)
+        while url.endswith(')') and url.count(')') > url.count('('):
+            url = url[:-1].rstrip(cls.URL_TRAILING_CHARS)
+        return url
+
+    def parse(self, response_text: str, raw_citations=None) -> List[dict]:
+        """Merge structured citations and text records into deduplicated paper dicts"""
+        papers: dict = {}
+
+        for c in (raw_citations or [])[:self.max_papers]:
+            title, url, snippet = self._citation_fields(c)
+            # Clean and validate title
+            if title and title != "Research Paper":
                 title = clean_title(title)
-                
-                # Update existing paper if URL matches, otherwise add new
-                existing = next((p for p in papers if p['url'] == url), None)
+            # If still generic, try to extract from URL
+            if (not title or title == "Research Paper") and url:
+                title = extract_title_from_url(url)
+            if url and url not in papers:
+                papers[url] = {"title": title, "url": url, "snippet": snippet}
+
+        if response_text:
+            for record in self.tokenize(response_text)[:self.max_papers]:
+                url = record['url']
+                title = clean_title(record.get('title') or extract_title_from_url(url))
+                existing = papers.get(url)
                 if existing:
                     if existing['title'] == "Research Paper" or len(title) > len(existing['title']):
                         existing['title'] = title
+                    if not existing['snippet'] and record.get('description'):
+                        existing['snippet'] = record['description'][:self.snippet_length]
                 else:
-                    snippet = ""
-                    # Try to extract description
-                    desc_pattern = rf'{re.escape(url)}.*?Description:\s*(.+?)(?:\n\n|Title:|$)'
-                    desc_match = re.search(desc_pattern, response_text, re.DOTALL | re.IGNORECASE)
-                    if desc_match:
-                        snippet = desc_match.group(1).strip()[:200]
-                    
-                    papers.append({"title": title, "url": url, "snippet": snippet})
-
-        # Final cleanup and deduplication
-        seen_urls = set()
-        unique_papers = []
-        for p in papers:
-            if p['url'] and p['url'] not in seen_urls:
-                seen_urls.add(p['url'])
-                # One final check on title
-                if p['title'] == "Research Paper" or not p['title']:
-                    p['title'] = extract_title_from_url(p['url'])
-                unique_papers.append(p)
+                    snippet = (record.get('description') or "")[:self.snippet_length]
+                    papers[url] = {"title": title, "url": url, "snippet": snippet}
 
-        # If still no papers, create fallback with better titles
-        if not unique_papers:
-            print(f"No papers extracted, creating demo papers for: {query}")
-            unique_papers = [
-                {
-                    "title": f"A Comprehensive Survey of {query}: Recent Advances and Future Directions",
-                    "url": "https://arxiv.org/abs/2301.00000",
-                    "snippet": f"This survey paper provides a comprehensive overview of recent developments in {query}, analyzing current methodologies and future research directions."
-                },
-                {
-                    "title": f"Deep Learning Approaches to {query}: Methods and Applications",
-                    "url": "https://ieeexplore.ieee.org/document/0000000",
-                    "snippet": f"An exploration of modern machine learning techniques applied to {query}, with practical implementations and case studies."
-                },
-                {
-                    "title": f"The Impact of {query} on Contemporary Research: A Meta-Analysis",
-                    "url": "https://www.nature.com/articles/s41586-000-0000-0",
-                    "snippet": f"This meta-analysis examines the broader implications and research trends in {query} across multiple domains."
-                }
-            ]
+        # One final check on titles
+        for paper in papers.values():
+            if paper['title'] == "Research Paper" or not paper['title']:
+                paper['title'] = extract_title_from_url(paper['url'])
+        return list(papers.values())
+
+    @staticmethod
+    def _citation_fields(c) -> Tuple[str, str, str]:
+        if isinstance(c, dict):
+            title = c.get("title") or c.get("name") or ""
+            url = c.get("url") or c.get("link") or ""
+            snippet = c.get("text") or c.get("snippet") or c.get("description") or ""
+            return title, url, snippet
+        if isinstance(c, str):
+            return "", c, ""
+        try:
+            return "", str(c), ""
+        except Exception:
+            return "", "", ""
 
-        return unique_papers[:10]
+sonar_parser = SonarResponseParser(max_papers=SEARCH_CANDIDATES)
 
-    except Exception as e:
-        print(f"Error in search_papers: {e}")
-        import traceback
-        traceback.print_exc()
-        return []
+# =====================
+# Structured output parsing
+# =====================
 
-def generate_summary(paper: dict, query: str) -> PaperSummary:
+SUMMARY_FIELDS = ("title", "key_findings", "methodology", "limitations", "summary", "relevance_score", "authenticity_score")
+SUMMARY_TEXT_FIELDS = ("title", "key_findings", "methodology", "limitations", "summary")
+SUMMARY_SCORE_FIELDS = ("relevance_score", "authenticity_score")
+
+class SummaryExtractor:
     """
-    Generate CONCISE structured summary using Sonar-Pro (under 200 words total)
-    Also attempts to get the actual paper title if needed
+    Tolerant reader for the JSON that sonar-pro returns. The first object
+    (or array) in the reply is decoded in place, so prose and code fences
+    around it cost nothing. Only when that fails is the reply scanned for
+    the balanced value, skipping brackets inside strings, and repaired
+    (smart quotes, trailing commas); a reply cut off mid-object keeps every
+    member completed before the cut.
     """
-    try:
-        # If title is generic, try to get actual title
-        current_title = paper.get('title', 'Unknown')
-        if current_title in ['Research Paper', 'Unknown', ''] or current_title.startswith('http'):
-            title_prompt = f"""
-            Based on this URL: {paper.get('url', '')}
-            And this description: {paper.get('snippet', '')}
-            
-            What is the actual title of this research paper? Provide ONLY the title, nothing else.
-            """
-            
+
+    SMART_QUOTES = str.maketrans({'“': '"', '”': '"', '„': '"', '‟': '"', '‘': "'", '’': "'"})
+    TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+    FIELD_RE = re.compile(r'"(\w+)"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?)')
+    NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+    # A whole (or unterminated) string, or one structural character
+    TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"?|[{}\[\],]', re.DOTALL)
+
+    def __init__(self, max_candidates: int = 4):
+        # Opening brackets tried before giving up, so "{...}" in prose
+        # ahead of the JSON costs at most a few extra scans
+        self.max_candidates = max_candidates
+        self._decoder = json.JSONDecoder()
+
+    def scan(self, text: str, start: int) -> Tuple[Optional[str], int]:
+        """
+        Balanced value starting at text[start], and the index after it. When
+        the text ends first, the value closed after its last complete
+        top-level member (None if there is none) and len(text).
+        """
+        closer = '}' if text[start] == '{' else ']'
+        depth = 0
+        last_member = None
+        for token in self.TOKEN_RE.finditer(text, start):
+            ch = token.group(0)
+            if ch in '{[':
+                depth += 1
+            elif ch in '}]':
+                depth -= 1
+                if depth == 0:
+                    return text[start:token.end()], token.end()
+                if depth == 1:
+                    last_member = token.end()
+            elif ch == ',' and depth == 1:
+                last_member = token.start()
+        if last_member is None:
+            return None, len(text)
+        return text[start:last_member].rstrip().rstrip(',') + closer, len(text)
+
+    def decode(self, fragment: str):
+        """json.loads, then again after dropping trailing commas; None if both fail"""
+        for attempt in (fragment, self.TRAILING_COMMA_RE.sub(r'\1', fragment)):
             try:
-                title_response = client.chat.completions.create(
-                    model="sonar",
-                    messages=[
-                        {"role": "system", "content": "You extract paper titles. Respond with ONLY the paper title, nothing else."},
-                        {"role": "user", "content": title_prompt}
-                    ]
-                )
-                extracted_title = title_response.choices[0].message.content.strip()
-                if extracted_title and len(extracted_title) > 10 and len(extracted_title) < 200:
-                    current_title = clean_title(extracted_title)
-            except:
-                pass
-        
-        prompt = f"""
-        Analyze this academic paper and provide a BRIEF structured summary in JSON format.
-        KEEP IT CONCISE - each field should be 1-2 sentences MAX.
-        
-        Title: {current_title}
-        URL: {paper.get('url', '')}
-        Description: {paper.get('snippet', 'No description available')}
-        
+                return json.loads(attempt)
+            except ValueError:
+                continue
+        return None
+
+    def loads(self, text: str, opener: str = '{'):
+        """First JSON object (or array, with opener '[') in text, or None"""
+        for repaired in (False, True):
+            candidate = text.translate(self.SMART_QUOTES) if repaired else text
+            position = candidate.find(opener)
+            for _ in range(self.max_candidates):
+                if position == -1:
+                    break
+                if not repaired:
+                    try:
+                        return self._decoder.raw_decode(candidate, position)[0]
+                    except ValueError:
+                        pass
+                fragment, _ = self.scan(candidate, position)
+                value = self.decode(fragment) if fragment else None
+                if value is not None:
+                    return value
+                position = candidate.find(opener, position + 1)
+        return None
+
+    def salvage(self, text: str) -> dict:
+        """Last resort: pick out "field": value pairs wherever they appear"""
+        data = {}
+        for name, raw in self.FIELD_RE.findall(text.translate(self.SMART_QUOTES)):
+            if name in SUMMARY_FIELDS and name not in data:
+                try:
+                    data[name] = json.loads(raw)
+                except ValueError:
+                    continue
+        return data
+
+    def score(self, value) -> Optional[int]:
+        """0-100 integer from 85, 85.0, "85", "85%" or "85/100"; None if there is no number"""
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, str):
+            match = self.NUMBER_RE.search(value)
+            if not match:
+                return None
+            value = match.group(0)
+        try:
+            return max(0, min(100, int(round(float(value)))))
+        except (TypeError, ValueError, OverflowError):
+            return None
+
+    def validate(self, data) -> Tuple[dict, List[str]]:
+        """Usable PaperSummary fields of data (coerced, scores clamped) and the names of the rest"""
+        fields = {}
+        if isinstance(data, dict):
+            for field in SUMMARY_TEXT_FIELDS:
+                value = data.get(field)
+                if isinstance(value, (str, int, float)) and not isinstance(value, bool) and str(value).strip():
+                    fields[field] = str(value).strip()
+            for field in SUMMARY_SCORE_FIELDS:
+                score = self.score(data.get(field))
+                if score is not None:
+                    fields[field] = score
+            if 'title' in fields:
+                fields['title'] = clean_title(fields['title'])
+                if fields['title'] == "Research Paper":
+                    del fields['title']
+        return fields, [field for field in SUMMARY_FIELDS if field not in fields]
+
+    def parse_summary(self, text: str, default_title: Optional[str] = None) -> Tuple[dict, List[str]]:
+        """PaperSummary fields found in a reply, and the fields still missing"""
+        data = self.loads(text)
+        if not isinstance(data, dict):
+            data = self.salvage(text)
+        fields, missing = self.validate(data)
+        if 'title' in missing and default_title:
+            fields['title'] = clean_title(default_title)
+            missing.remove('title')
+        return fields, missing
+
+summary_extractor = SummaryExtractor()
+
+# =====================
+# Local title resolution
+# =====================
+
+# Persistent URL/identifier -> title index, filled from successful summaries
+TITLE_INDEX_PATH = os.getenv("SCHOLARSWIPE_TITLE_INDEX_PATH", "scholarswipe.db")
+
+GENERIC_TITLES = {'', 'research paper', 'unknown', 'unknown paper', 'pdf', 'abstract', 'full text'}
+
+_ARXIV_ID_RE = re.compile(r'arxiv\.org/(?:abs|pdf|html|format)/((?:\d{4}\.\d{4,5})|(?:[a-z\-]+(?:\.[A-Z]{2})?/\d{7}))(?:v\d+)?', re.IGNORECASE)
+_DOI_RE = re.compile(r'\b(10\.\d{4,9}/[^\s?#]+)', re.IGNORECASE)
+_DOI_SUFFIX_RE = re.compile(r'(?:\.pdf|/(?:full|abstract|pdf|epdf|html|meta))+$', re.IGNORECASE)
+_IEEE_ID_RE = re.compile(r'ieeexplore\.ieee\.org/(?:abstract/)?document/(\d+)', re.IGNORECASE)
+_NATURE_ID_RE = re.compile(r'nature\.com/articles/([a-z0-9][a-z0-9.\-]+?)(?:\.pdf)?(?:[/?#]|$)', re.IGNORECASE)
+_ACM_DOI_RE = re.compile(r'dl\.acm\.org/doi/(?:abs/|pdf/|full/|epdf/)?(10\.\d{4,9}/[^\s?#/]+)', re.IGNORECASE)
+_QUOTED_TITLE_RE = re.compile(r'["“‘]([^"”’]{15,200})["”’]')
+_SLUG_WORD_RE = re.compile(r'[A-Za-z]{2,}')
+_SLUG_ID_SUFFIX_RE = re.compile(r'[-_]?\d[\d\-_.]*$')
+
+def extract_paper_ids(url: str) -> dict:
+    """
+    Identifiers recognizable from a paper URL alone: arXiv id, DOI (including
+    ACM and Nature article URLs, which embed or imply one) and IEEE document
+    number. Returned as {"arxiv": ..., "doi": ..., "ieee": ...}; absent keys
+    were not found.
+    """
+    ids: dict = {}
+    if not url:
+        return ids
+    match = _ARXIV_ID_RE.search(url)
+    if match:
+        ids['arxiv'] = match.group(1).lower()
+    match = _ACM_DOI_RE.search(url) or _DOI_RE.search(url)
+    if match:
+        ids['doi'] = _DOI_SUFFIX_RE.sub('', match.group(1)).lower()
+    match = _NATURE_ID_RE.search(url)
+    if match and 'doi' not in ids:
+        # Nature article ids are the suffix of a 10.1038 DOI
+        ids['doi'] = f"10.1038/{match.group(1).lower()}"
+    match = _IEEE_ID_RE.search(url)
+    if match:
+        ids['ieee'] = match.group(1)
+    return ids
+
+def is_generic_title(title: Optional[str]) -> bool:
+    """True for placeholder titles that say nothing about the paper"""
+    if not title:
+        return True
+    title = title.strip()
+    return title.lower() in GENERIC_TITLES or title.startswith('http')
+
+class TitleIndex:
+    """
+    Persistent title lookup keyed by paper identifier ("arxiv:...", "doi:...",
+    "ieee:...") and by URL, in a local SQLite file. `abs/` and `pdf/` links
+    to the same arXiv paper share one entry through the identifier.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS titles ("
+                " key TEXT PRIMARY KEY, title TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    @staticmethod
+    def keys_for(url: str) -> List[str]:
+        keys = [f"{kind}:{value}" for kind, value in extract_paper_ids(url).items()]
+        if url:
+            keys.append(f"url:{url.split('#', 1)[0].rstrip('/')}")
+        return keys
+
+    def get(self, url: str) -> Optional[str]:
+        keys = self.keys_for(url)
+        if not keys:
+            return None
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, title FROM titles WHERE key IN ({','.join('?' * len(keys))})", keys
+            ).fetchall()
+        found = dict(rows)
+        # Identifiers first: they survive URL variations
+        for key in keys:
+            if key in found:
+                return found[key]
+        return None
+
+    def remember(self, url: str, title: str):
+        if is_generic_title(title):
+            return
+        keys = self.keys_for(url)
+        if not keys:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO titles (key, title, updated_at) VALUES (?, ?, ?)",
+                [(key, title, now) for key in keys]
+            )
+
+class TitleResolver:
+    """
+    Finds a real title for a paper without calling an LLM. It tries, in
+    order: the title index, a quoted title in the snippet, then a readable
+    URL slug. resolve() returns None when every local step fails; only then
+    should the caller spend an LLM call, which it reports with
+    record_llm_fallback().
+    """
+
+    def __init__(self, index: Optional[TitleIndex]):
+        self.index = index
+
+    async def resolve(self, paper: dict) -> Optional[str]:
+        url = paper.get('url', '') or ''
+        indexed = await asyncio.to_thread(self.index.get, url) if self.index is not None and url else None
+        for source, candidate in (
+            ("index", lambda: indexed),
+            ("snippet", lambda: title_from_snippet(paper.get('snippet') or '')),
+            ("url_slug", lambda: title_from_url_slug(url)),
+        ):
+            title = candidate()
+            if title and not is_generic_title(title):
+                metrics.inc("scholarswipe_title_resolution_total", {"source": source})
+                return clean_title(title)
+        return None
+
+    def remember(self, url: str, title: str):
+        if self.index is not None and url:
+            try:
+                self.index.remember(url, title)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not update title index: {e}")
+
+    @staticmethod
+    def record_llm_fallback(resolved: bool):
+        metrics.inc("scholarswipe_title_resolution_total", {"source": "llm" if resolved else "unresolved"})
+
+def title_from_snippet(snippet: str) -> Optional[str]:
+    """A quoted multi-word phrase in the description is usually the title"""
+    match = _QUOTED_TITLE_RE.search(snippet)
+    if match and len(match.group(1).split()) >= 3:
+        return match.group(1).strip()
+    return None
+
+def title_from_url_slug(url: str) -> Optional[str]:
+    """
+    Title from a descriptive URL slug (e.g. .../graph-neural-networks-a-review-123),
+    skipping segments that are identifiers rather than words
+    """
+    path = url.split('?', 1)[0].split('#', 1)[0]
+    for part in reversed(path.rstrip('/').split('/')[3:]):
+        part = _URL_EXTENSION_RE.sub('', part)
+        part = _SLUG_ID_SUFFIX_RE.sub('', part)
+        words = [w for w in re.split(r'[-_+\s]+|%20', part) if w]
+        alpha_words = [w for w in words if _SLUG_WORD_RE.fullmatch(w)]
+        # Mostly real words, and enough of them to be a title
+        if len(alpha_words) >= 3 and len(alpha_words) >= 0.75 * len(words):
+            return ' '.join(words)[:150]
+    return None
+
+def _open_title_index() -> Optional[TitleIndex]:
+    if not TITLE_INDEX_PATH:
+        return None
+    try:
+        return TitleIndex(TITLE_INDEX_PATH)
+    except sqlite3.Error as e:
+        logger.warning(f"Title index unavailable ({TITLE_INDEX_PATH}): {e}")
+        return None
+
+title_resolver = TitleResolver(_open_title_index())
+
+# =====================
+# Paper store
+# =====================
+
+# Local SQLite store of query-independent paper data (title, snippet and the
+# summary fields other than relevance), keyed by canonical paper identity
+PAPER_STORE_PATH = os.getenv("SCHOLARSWIPE_PAPER_STORE_PATH", "scholarswipe.db")
+
+# Query parameters that only track where a click came from
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'msclkid', 'ref', 'referrer', 'source', 'src', 'via',
+    'sessionid', 'sid', 'mc_cid', 'mc_eid', 'utm', '_ga', 'trk', 'ved', 'ei'
+}
+
+def normalize_url(url: str) -> str:
+    """
+    Normalize a paper URL: lowercase scheme and host, no "www.", no fragment,
+    no tracking query parameters, no trailing slash
+    """
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url.strip()
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    query = urlencode(sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in TRACKING_PARAMS and not k.lower().startswith('utm_')
+    ))
+    return urlunsplit(('https' if parts.scheme in ('http', 'https') else parts.scheme, host, parts.path.rstrip('/'), query, ''))
+
+def canonical_paper_id(url: str) -> str:
+    """
+    Stable identity for a paper across URL variants: its arXiv id, DOI or
+    IEEE document number when the URL carries one (so abs/ and pdf/ links
+    collapse), otherwise the normalized URL
+    """
+    ids = extract_paper_ids(url)
+    for kind in ('arxiv', 'doi', 'ieee'):
+        if kind in ids:
+            return f"{kind}:{ids[kind]}"
+    return f"url:{normalize_url(url)}" if url else ""
+
+def dedupe_papers(papers: List[dict]) -> List[dict]:
+    """Drop later papers that are URL variants of an earlier one"""
+    seen = set()
+    unique = []
+    for paper in papers:
+        paper_id = canonical_paper_id(paper.get('url', ''))
+        if paper_id in seen:
+            continue
+        seen.add(paper_id)
+        unique.append(paper)
+    return unique
+
+STORED_SUMMARY_FIELDS = ("key_findings", "methodology", "limitations", "summary", "authenticity_score")
+
+class PaperStore:
+    """
+    Persistent, query-independent paper records. Once a paper has been
+    summarized for any query, its title, snippet and summary fields are kept
+    here so later queries only need a new relevance_score.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS papers ("
+                " paper_id TEXT PRIMARY KEY, url TEXT NOT NULL, title TEXT NOT NULL,"
+                " snippet TEXT, key_findings TEXT, methodology TEXT, limitations TEXT,"
+                " summary TEXT, authenticity_score INTEGER, updated_at REAL NOT NULL)"
+            )
+
+    def get(self, url: str) -> Optional[dict]:
+        paper_id = canonical_paper_id(url)
+        if not paper_id:
+            return None
+        with self._lock:
+            self._conn.row_factory = sqlite3.Row
+            row = self._conn.execute("SELECT * FROM papers WHERE paper_id = ?", (paper_id,)).fetchone()
+            self._conn.row_factory = None
+        return dict(row) if row else None
+
+    def save(self, paper: dict, summary: PaperSummary):
+        paper_id = canonical_paper_id(paper.get('url', ''))
+        if not paper_id:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO papers (paper_id, url, title, snippet, key_findings,"
+                " methodology, limitations, summary, authenticity_score, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    paper_id, paper.get('url', ''), summary.title, paper.get('snippet') or '',
+                    summary.key_findings, summary.methodology, summary.limitations,
+                    summary.summary, summary.authenticity_score, time.time()
+                )
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM papers").fetchone()[0]
+
+def _open_paper_store() -> Optional[PaperStore]:
+    if not PAPER_STORE_PATH:
+        return None
+    try:
+        return PaperStore(PAPER_STORE_PATH)
+    except sqlite3.Error as e:
+        logger.warning(f"Paper store unavailable ({PAPER_STORE_PATH}): {e}")
+        return None
+
+paper_store = _open_paper_store()
+
+# =====================
+# Multi-worker coordination
+# =====================
+
+# With several worker processes (see __main__) anything that must be global
+# lives in the shared SQLite file (SCHOLARSWIPE_CACHE_SQLITE_PATH): the
+# response cache above, paged search sessions, the per-model upstream rate
+# limit buckets and leases for one-off work such as the startup warm-up
+
+class SharedLimiter:
+    """
+    Token buckets and leases kept in a SQLite file, so every worker process
+    draws from the same per-model upstream budget
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # time.monotonic() until which acquire() only uses the per-process buckets
+        self.unavailable_until = 0.0
+        self._lock = threading.Lock()
+        # Autocommit; each operation is one explicit IMMEDIATE transaction
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets ("
+                " model TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                " name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def take(self, model: str, rate: float, burst: float) -> float:
+        """Take one token for model: 0 if one was free, else seconds until one will be (nothing taken)"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT tokens, updated_at FROM rate_buckets WHERE model = ?", (model,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + max(0.0, now - row[1]) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_buckets (model, tokens, updated_at) VALUES (?, ?, ?)",
+                (model, tokens, now)
+            )
+        return wait
+
+    async def acquire(self, model: str, rate: float, burst: float):
+        """
+        Wait for a token from the shared bucket. If the file can't be used
+        (e.g. locked), the caller's per-process bucket alone limits the call,
+        as when no shared limiter could be opened at startup.
+        """
+        while True:
+            if time.monotonic() < self.unavailable_until:
+                return
+            try:
+                wait = await asyncio.to_thread(self.take, model, rate, burst)
+            except sqlite3.Error as e:
+                self.unavailable_until = time.monotonic() + SHARED_CACHE_RETRY
+                logger.warning(f"Shared rate limits unavailable ({self.path}), limiting per process for {SHARED_CACHE_RETRY:.0f}s: {e}")
+                metrics.inc("scholarswipe_shared_cache_errors_total")
+                return
+            if wait <= 0:
+                return
+            # Jitter so workers woken together do not all retry at once
+            await asyncio.sleep(wait + random.uniform(0, wait / 2))
+
+    def claim(self, name: str, ttl: float) -> bool:
+        """Hold the named lease for ttl seconds unless another live owner holds it"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] != self.owner and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                (name, self.owner, now + ttl)
+            )
+        return True
+
+def _open_shared_limiter() -> Optional[SharedLimiter]:
+    if not CACHE_SQLITE_PATH:
+        return None
+    try:
+        return SharedLimiter(CACHE_SQLITE_PATH)
+    except sqlite3.Error as e:
+        logger.warning(f"Shared rate limits unavailable ({CACHE_SQLITE_PATH}), limiting per process: {e}")
+        return None
+
+shared_limits = _open_shared_limiter()
+
+# =====================
+# Upstream scheduling
+# =====================
+
+# Requests per second (and burst) allowed per model, e.g. "sonar=10,sonar-pro=5";
+# models not listed use UPSTREAM_DEFAULT_RATE, and 0 means unlimited
+UPSTREAM_RATE_LIMITS = os.getenv("SCHOLARSWIPE_UPSTREAM_RATE_LIMITS", "sonar=10,sonar-pro=5")
+UPSTREAM_DEFAULT_RATE = float(os.getenv("SCHOLARSWIPE_UPSTREAM_DEFAULT_RATE", "5"))
+# Retries of transient failures (timeouts, connection errors, 429 and 5xx)
+# with full-jitter exponential backoff
+UPSTREAM_MAX_RETRIES = int(os.getenv("SCHOLARSWIPE_UPSTREAM_MAX_RETRIES", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("SCHOLARSWIPE_UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("SCHOLARSWIPE_UPSTREAM_BACKOFF_MAX", "8"))
+# The circuit for a model opens after this many consecutive transient
+# failures and lets one probe through after the cooldown
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("SCHOLARSWIPE_BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("SCHOLARSWIPE_BREAKER_COOLDOWN", "30"))
+
+# Lower value goes first when a model's rate limit is the bottleneck
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+upstream_priority: ContextVar[int] = ContextVar("upstream_priority", default=PRIORITY_INTERACTIVE)
+
+TRANSIENT_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+
+class UpstreamUnavailable(Exception):
+    """Raised without calling Perplexity while a model's circuit is open"""
+
+    def __init__(self, model: str, retry_after: float):
+        super().__init__(f"Upstream {model} unavailable, retry in {retry_after:.0f}s")
+        self.model = model
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` per second up to `burst`. Callers that
+    have to wait are queued by (priority, arrival), so interactive work
+    overtakes queued background work.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+        self._waiters: list = []
+        self._order = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _dispatch(self):
+        self._timer = None
+        self._refill()
+        while self._waiters and self.tokens >= 1:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if waiter.done():
+                continue
+            self.tokens -= 1
+            waiter.set_result(None)
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        if self._waiters:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later((1 - self.tokens) / self.rate, self._dispatch)
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE):
+        self._refill()
+        if not self._waiters and self.tokens >= 1:
+            self.tokens -= 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), waiter))
+        if self._timer is None:
+            self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as we were cancelled: hand the token back
+                self.tokens = min(self.burst, self.tokens + 1)
+            raise
+
+    def waiting(self) -> int:
+        return sum(1 for _, _, waiter in self._waiters if not waiter.done())
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open probe after a cooldown"""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def check(self, model: str):
+        """Raise UpstreamUnavailable unless a call may go through now"""
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return
+        raise UpstreamUnavailable(model, max(1.0, self.cooldown - (time.monotonic() - self.opened_at)))
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or (self.threshold > 0 and self.failures >= self.threshold):
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def release(self):
+        """The call ended without telling us anything (cancelled, non-transient error)"""
+        self._probing = False
+
+def parse_rate_limits(spec: str) -> dict:
+    """"sonar=10,sonar-pro=5" -> {"sonar": 10.0, "sonar-pro": 5.0}"""
+    rates = {}
+    for part in spec.split(','):
+        model, sep, rate = part.partition('=')
+        if not sep:
+            continue
+        try:
+            rates[model.strip()] = float(rate)
+        except ValueError:
+            logger.warning(f"Ignoring bad rate limit {part!r}")
+    return rates
+
+def retry_delay(attempt: int, error: Exception) -> float:
+    """Full-jitter exponential backoff, or the server's Retry-After when it sends one"""
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            return min(UPSTREAM_BACKOFF_MAX, float(response.headers.get("retry-after")))
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** attempt))
+
+class UpstreamScheduler:
+    """
+    The one way Perplexity is called: per-model rate limiting with priority,
+    retries of transient failures and a per-model circuit breaker
+    """
+
+    def __init__(self, rates: dict, default_rate: float):
+        self.rates = rates
+        self.default_rate = default_rate
+        self._buckets: dict = {}
+        self._breakers: dict = {}
+
+    def bucket(self, model: str) -> Optional[TokenBucket]:
+        rate = self.rates.get(model, self.default_rate)
+        if rate <= 0:
+            return None
+        if model not in self._buckets:
+            self._buckets[model] = TokenBucket(rate, rate)
+        return self._buckets[model]
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        if model not in self._breakers:
+            self._breakers[model] = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN)
+        return self._breakers[model]
+
+    async def call(self, model: str, send: Callable[[], Awaitable]):
+        breaker = self.breaker(model)
+        bucket = self.bucket(model)
+        priority = upstream_priority.get()
+        attempt = 0
+        while True:
+            breaker.check(model)
+            try:
+                if bucket is not None:
+                    await bucket.acquire(priority)
+                    # Then the budget shared by all worker processes
+                    if shared_limits is not None:
+                        await shared_limits.acquire(model, bucket.rate, bucket.burst)
+                response = await send()
+            except TRANSIENT_ERRORS as e:
+                # A 429 means the upstream is up but busy: back off, don't trip the breaker
+                if isinstance(e, RateLimitError):
+                    breaker.release()
+                else:
+                    breaker.record_failure()
+                if attempt >= UPSTREAM_MAX_RETRIES:
+                    raise
+                delay = retry_delay(attempt, e)
+                attempt += 1
+                metrics.inc("scholarswipe_upstream_retries_total", {"model": model, "error": type(e).__name__})
+                logger.warning(f"{model} call failed ({type(e).__name__}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return response
+
+    def stats(self) -> dict:
+        stats = {}
+        for model in sorted(set(self._breakers) | set(self._buckets)):
+            breaker = self.breaker(model)
+            bucket = self._buckets.get(model)
+            stats[model] = {
+                "circuit": breaker.state,
+                "consecutive_failures": breaker.failures,
+                "queued": bucket.waiting() if bucket else 0
+            }
+        return stats
+
+upstream = UpstreamScheduler(parse_rate_limits(UPSTREAM_RATE_LIMITS), UPSTREAM_DEFAULT_RATE)
+
+@contextmanager
+def background_priority():
+    """Upstream calls made (or tasks created) inside this block queue behind interactive ones"""
+    token = upstream_priority.set(PRIORITY_BACKGROUND)
+    try:
+        yield
+    finally:
+        upstream_priority.reset(token)
+
+# =====================
+# Usage accounting
+# =====================
+
+# Per model: USD per million prompt tokens, per million completion tokens
+# and (optionally) per request, e.g. "sonar=1:1:0.005"
+MODEL_PRICES = os.getenv("SCHOLARSWIPE_MODEL_PRICES", "sonar=1:1:0.005,sonar-pro=3:15:0.006")
+# Spend limits in USD (0 = no limit): per HTTP request, and per user over
+# the last USER_BUDGET_WINDOW seconds
+REQUEST_BUDGET = float(os.getenv("SCHOLARSWIPE_REQUEST_BUDGET", "0"))
+USER_BUDGET = float(os.getenv("SCHOLARSWIPE_USER_BUDGET", "0"))
+USER_BUDGET_WINDOW = float(os.getenv("SCHOLARSWIPE_USER_BUDGET_WINDOW", "86400"))
+# Once a budget runs low: papers per sonar-pro request, and the fewest cards still kept
+BUDGET_BATCH_SIZE = int(os.getenv("SCHOLARSWIPE_BUDGET_BATCH_SIZE", "5"))
+BUDGET_MIN_PAPERS = int(os.getenv("SCHOLARSWIPE_BUDGET_MIN_PAPERS", "3"))
+# One row per upstream call, kept USAGE_RETENTION seconds for /usage
+USAGE_STORE_PATH = os.getenv("SCHOLARSWIPE_USAGE_STORE_PATH", "scholarswipe.db")
+USAGE_RETENTION = float(os.getenv("SCHOLARSWIPE_USAGE_RETENTION", str(30 * 24 * 3600)))
+# Sent as X-Admin-Token to read /usage; unset, /usage only reports what no
+# single user or query can be picked out of
+USAGE_ADMIN_TOKEN = os.getenv("SCHOLARSWIPE_USAGE_ADMIN_TOKEN", "")
+
+# (prompt, completion) tokens per paper assumed for a stage until one of its
+# calls has been seen in this process
+DEFAULT_STAGE_TOKENS = {
+    "search": (350, 1500),
+    "summary": (450, 300),
+    "batch_summary": (250, 250),
+    "title_recovery": (120, 30),
+}
+USAGE_GROUP_COLUMNS = ("model", "stage", "endpoint", "query", "user_id")
+# Group-by keys that identify users or what they searched for
+USAGE_PRIVATE_COLUMNS = ("query", "user_id")
+
+class BudgetExceeded(Exception):
+    """Raised instead of calling Perplexity once the request's or the user's budget is spent"""
+
+    def __init__(self, budget: str, retry_after: float = 0):
+        message = "Request budget spent" if budget == "request" else "Usage budget for this user spent"
+        if retry_after:
+            message += f", retry in {retry_after:.0f}s"
+        super().__init__(message)
+        self.budget = budget
+        self.retry_after = retry_after
+
+def parse_model_prices(spec: str) -> dict:
+    """'sonar=1:1:0.005' -> {'sonar': (USD per prompt token, per completion token, per request)}"""
+    prices = {}
+    for part in spec.split(","):
+        model, _, value = part.partition("=")
+        try:
+            numbers = [float(n) for n in value.split(":")] + [0.0, 0.0, 0.0]
+        except ValueError:
+            logger.warning(f"Ignoring bad price {part!r}")
+            continue
+        if model.strip():
+            prices[model.strip()] = (numbers[0] / 1e6, numbers[1] / 1e6, numbers[2])
+    return prices
+
+class UsageLedger:
+    """
+    One row per upstream call (tokens, cost and who it was for) in SQLite,
+    shared by worker processes, plus this process's mean cost per paper of
+    each (model, stage) for budget planning
+    """
+
+    def __init__(self, path: str, prices: dict):
+        self.path = path
+        self.prices = prices
+        self._lock = threading.Lock()
+        self._means: dict = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        with self._lock, self._conn:
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage ("
+                " ts REAL NOT NULL, user_id TEXT NOT NULL, endpoint TEXT NOT NULL, query TEXT NOT NULL,"
+                " model TEXT NOT NULL, stage TEXT NOT NULL, prompt_tokens INTEGER NOT NULL,"
+                " completion_tokens INTEGER NOT NULL, cost REAL NOT NULL, client TEXT NOT NULL DEFAULT '')"
+            )
+            # Who the user budget applies to (see client_limit_key); rows
+            # from before the column existed count towards their user_id
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(usage)")}
+            if "client" not in columns:
+                self._conn.execute("ALTER TABLE usage ADD COLUMN client TEXT NOT NULL DEFAULT ''")
+                self._conn.execute("UPDATE usage SET client = user_id")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS usage_client_ts ON usage (client, ts)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS usage_user_ts ON usage (user_id, ts)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS usage_ts ON usage (ts)")
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        prompt_price, completion_price, request_price = self.prices.get(model, (0.0, 0.0, 0.0))
+        return prompt_tokens * prompt_price + completion_tokens * completion_price + request_price
+
+    def record(self, user_id: str, endpoint: str, query: str, model: str, stage: str,
+               usage, units: int = 1, client: Optional[str] = None) -> float:
+        """Store one call from the response's `usage`, against `client`'s budget (default user_id); returns its cost in USD"""
+        prompt_tokens = int(getattr(usage, "prompt_tokens", 0) or 0)
+        completion_tokens = int(getattr(usage, "completion_tokens", 0) or 0)
+        # Perplexity reports the billed cost when it can; otherwise price the tokens
+        reported = getattr(getattr(usage, "cost", None), "total_cost", None)
+        cost = float(reported) if isinstance(reported, (int, float)) else self.cost(model, prompt_tokens, completion_tokens)
+        with self._lock:
+            seen = self._means.setdefault((model, stage), [0.0, 0])
+            seen[0] += cost
+            seen[1] += max(1, units)
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO usage (ts, user_id, endpoint, query, model, stage, prompt_tokens, completion_tokens, cost, client)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (time.time(), user_id, endpoint, normalize_query(query)[:200], model, stage,
+                     prompt_tokens, completion_tokens, cost, user_id if client is None else client)
+                )
+        metrics.inc("scholarswipe_upstream_tokens_total", {"model": model, "stage": stage, "kind": "prompt"}, prompt_tokens)
+        metrics.inc("scholarswipe_upstream_tokens_total", {"model": model, "stage": stage, "kind": "completion"}, completion_tokens)
+        metrics.inc("scholarswipe_upstream_cost_usd_total", {"model": model, "stage": stage}, cost)
+        return cost
+
+    def estimate(self, model: str, stage: str) -> float:
+        """Expected USD per paper for a call: the mean so far, else from DEFAULT_STAGE_TOKENS"""
+        with self._lock:
+            seen = self._means.get((model, stage))
+        if seen and seen[1]:
+            return seen[0] / seen[1]
+        return self.cost(model, *DEFAULT_STAGE_TOKENS.get(stage, (500, 500)))
+
+    def user_spend(self, client: str) -> float:
+        """USD spent for a client (see client_limit_key) within USER_BUDGET_WINDOW"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(SUM(cost), 0) FROM usage WHERE client = ? AND ts >= ?",
+                (client, time.time() - USER_BUDGET_WINDOW)
+            ).fetchone()[0]
+
+    def retry_after(self, client: str) -> float:
+        """Seconds until the client's oldest spend in the window stops counting"""
+        with self._lock:
+            oldest = self._conn.execute(
+                "SELECT MIN(ts) FROM usage WHERE client = ? AND ts >= ?",
+                (client, time.time() - USER_BUDGET_WINDOW)
+            ).fetchone()[0]
+        return max(1.0, oldest + USER_BUDGET_WINDOW - time.time()) if oldest else USER_BUDGET_WINDOW
+
+    def aggregate(self, since: float, group_by: List[str], limit: int = 100) -> List[dict]:
+        """Calls, tokens and cost since `since`, per group, costliest first"""
+        columns = [column for column in group_by if column in USAGE_GROUP_COLUMNS]
+        selected = "".join(f"{column}, " for column in columns)
+        grouping = f" GROUP BY {', '.join(columns)}" if columns else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {selected}COUNT(*), COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0),"
+                f" COALESCE(SUM(cost), 0) FROM usage WHERE ts >= ?{grouping} ORDER BY 4 + {len(columns)} DESC LIMIT ?",
+                (since, max(1, limit))
+            ).fetchall()
+        keys = (*columns, "calls", "prompt_tokens", "completion_tokens", "cost_usd")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def purge(self, older_than: float):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM usage WHERE ts < ?", (older_than,))
+
+def _open_usage_ledger() -> UsageLedger:
+    prices = parse_model_prices(MODEL_PRICES)
+    if USAGE_STORE_PATH:
+        try:
+            ledger = UsageLedger(USAGE_STORE_PATH, prices)
+            ledger.purge(time.time() - USAGE_RETENTION)
+            return ledger
+        except sqlite3.Error as e:
+            logger.warning(f"Usage store unavailable ({USAGE_STORE_PATH}), keeping usage in memory: {e}")
+    return UsageLedger(":memory:", prices)
+
+usage_ledger = _open_usage_ledger()
+
+class UsageScope:
+    """Who a request's (or background job's) upstream calls are charged to, and what it has spent"""
+
+    def __init__(self, user_id: str, endpoint: str, limit: Optional[float] = None, asgi_scope: Optional[dict] = None,
+                 limit_key: Optional[str] = None):
+        self.user_id = user_id
+        # Who USER_BUDGET applies to (see client_limit_key); user_id only labels usage
+        self.limit_key = user_id if limit_key is None else limit_key
+        # REQUEST_BUDGET unless given; 0 = no limit of its own
+        self.limit = REQUEST_BUDGET if limit is None else limit
+        self.spent = 0.0
+        # The user's spend in the window as of the last check(), so
+        # remaining() never reads SQLite on the event loop
+        self.user_spent = 0.0
+        # Set once a budget_plan() had to cut back; later decisions stay cheap
+        self.degraded = False
+        # False for work shared between requests (see shared_flight)
+        self.enforced = True
+        self._endpoint = endpoint
+        self._asgi_scope = asgi_scope
+
+    @property
+    def endpoint(self) -> str:
+        """The route template (/jobs/{job_id}) once routing has matched, else the raw path"""
+        route = self._asgi_scope.get("route") if self._asgi_scope else None
+        return getattr(route, "path", None) or self._endpoint
+
+    def remaining(self) -> float:
+        """USD this scope may still spend: the lower of its own and its user's remaining budget"""
+        if not self.enforced:
+            return math.inf
+        remaining = self.limit - self.spent if self.limit > 0 else math.inf
+        if USER_BUDGET > 0:
+            remaining = min(remaining, USER_BUDGET - self.user_spent)
+        return remaining
+
+    async def check(self):
+        """Raise BudgetExceeded if either budget is already spent"""
+        if not self.enforced:
+            return
+        if self.limit > 0 and self.spent >= self.limit:
+            metrics.inc("scholarswipe_budget_exceeded_total", {"budget": "request"})
+            raise BudgetExceeded("request")
+        if USER_BUDGET > 0:
+            self.user_spent = await asyncio.to_thread(usage_ledger.user_spend, self.limit_key)
+            if self.user_spent >= USER_BUDGET:
+                metrics.inc("scholarswipe_budget_exceeded_total", {"budget": "user"})
+                raise BudgetExceeded("user", await asyncio.to_thread(usage_ledger.retry_after, self.limit_key))
+
+    def shared(self) -> "UsageScope":
+        """
+        Scope for work other requests may join: recorded in the ledger under
+        this user, but never limited, so it can't fail on this user's budget
+        """
+        scope = UsageScope(self.user_id, self.endpoint, limit=0, limit_key=self.limit_key)
+        scope.enforced = False
+        scope.degraded = self.degraded
+        return scope
+
+# Set per HTTP request by the track_requests middleware; None outside requests
+# (warm-up), whose calls are recorded but never limited
+request_usage: ContextVar[Optional[UsageScope]] = ContextVar("request_usage", default=None)
+
+@contextmanager
+def usage_scope(scope: UsageScope):
+    """Upstream calls made (or tasks created) inside this block are charged to `scope`"""
+    token = request_usage.set(scope)
+    try:
+        yield
+    finally:
+        request_usage.reset(token)
+
+def budget_plan(count: int) -> Tuple[int, int, bool]:
+    """
+    How to summarize `count` papers within what the current request may
+    still spend: (papers to keep, papers per sonar-pro request, whether sonar
+    may be asked for missing titles). Degrades in steps: title recovery is
+    dropped and summaries are batched first, then fewer papers are kept.
+    """
+    batch_size = max(1, SUMMARY_BATCH_SIZE)
+    scope = request_usage.get()
+    if scope is None or count <= 0:
+        return count, batch_size, True
+    remaining = scope.remaining()
+    if remaining == math.inf and not scope.degraded:
+        return count, batch_size, True
+
+    per_paper = (usage_ledger.estimate("sonar-pro", "summary" if batch_size == 1 else "batch_summary")
+                 + usage_ledger.estimate("sonar", "title_recovery"))
+    if not scope.degraded and remaining >= count * per_paper:
+        return count, batch_size, True
+    scope.degraded = True
+    affordable = count if remaining == math.inf else int(max(0.0, remaining) / usage_ledger.estimate("sonar-pro", "batch_summary"))
+    return min(count, max(BUDGET_MIN_PAPERS, affordable)), max(batch_size, BUDGET_BATCH_SIZE), False
+
+async def shared_flight(flight: SingleFlight, key: str, work: Callable[[], Awaitable]):
+    """
+    flight.do() with budgets kept per caller. Each caller's own budget is
+    checked before it joins, the shared work runs budget-neutral (see
+    UsageScope.shared) and every caller's request budget is charged what the
+    work cost. Work planned for a degraded request (no title recovery) is
+    only shared within its user.
+    """
+    scope = request_usage.get()
+    if scope is not None:
+        await scope.check()
+        if scope.degraded:
+            key = f"{key}\ndegraded:{scope.user_id}"
+    work_scope = scope.shared() if scope is not None else None
+
+    async def run():
+        if work_scope is None:
+            return await work(), None, 1
+        with usage_scope(work_scope):
+            return await work(), work_scope, 1
+
+    result, charged, share = await flight.do(key, run)
+    if scope is not None and charged is not None:
+        scope.spent += charged.spent / share
+    return result
+
+async def shared_flight_many(flight: SingleFlight, keys: List[str], work: Callable[[List[str]], Awaitable[list]]) -> list:
+    """
+    shared_flight() for several keys through flight.do_many(): work(led_keys)
+    gets only the keys nobody is working on yet, and each caller is charged
+    its keys' share of what the shared call cost
+    """
+    scope = request_usage.get()
+    suffix = ""
+    if scope is not None:
+        await scope.check()
+        if scope.degraded:
+            suffix = f"\ndegraded:{scope.user_id}"
+    work_scope = scope.shared() if scope is not None else None
+    original = {key + suffix: key for key in keys}
+
+    async def run(led: List[str]) -> list:
+        if work_scope is None:
+            results = await work([original[key] for key in led])
+        else:
+            with usage_scope(work_scope):
+                results = await work([original[key] for key in led])
+        return [(result, work_scope, len(led)) for result in results]
+
+    outcomes = await flight.do_many([key + suffix for key in keys], run)
+    if scope is not None:
+        scope.spent += sum(charged.spent / share for _, charged, share in outcomes if charged is not None)
+    return [result for result, _, _ in outcomes]
+
+# =====================
+# Perplexity calls
+# =====================
+
+async def chat_completion(model: str, messages: List[dict], stage: str = "upstream",
+                          query: str = "", units: int = 1):
+    """
+    Send one chat completion to Perplexity without blocking the event loop.
+    Uses the pooled async client when the app is running, otherwise runs the
+    blocking client in a worker thread. Goes through the upstream scheduler
+    (rate limit, retries, circuit breaker). Each call is counted per model
+    and timed under `stage`, and its token usage is charged to the current
+    UsageScope for `query`; `units` is how many papers it covers. Raises
+    BudgetExceeded without calling once that scope's budget is spent.
+    """
+    async def send():
+        if async_client is not None:
+            return await async_client.chat.completions.create(model=model, messages=messages)
+        return await asyncio.to_thread(client.chat.completions.create, model=model, messages=messages)
+
+    outcome = "error"
+    start = time.perf_counter()
+    scope = request_usage.get()
+    try:
+        if scope is not None:
+            await scope.check()
+        with metrics.timer(stage):
+            response = await upstream.call(model, send)
+        outcome = "ok"
+        try:
+            cost = await asyncio.to_thread(
+                usage_ledger.record,
+                scope.user_id if scope else "-", scope.endpoint if scope else "background",
+                query, model, stage, getattr(response, "usage", None), units,
+                scope.limit_key if scope else None
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Could not record usage: {e}")
+        else:
+            if scope is not None:
+                scope.spent += cost
+                scope.user_spent += cost
+        return response
+    except BudgetExceeded:
+        outcome = "over_budget"
+        raise
+    except UpstreamUnavailable:
+        outcome = "unavailable"
+        raise
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        metrics.inc("scholarswipe_upstream_calls_total", {"model": model, "stage": stage, "outcome": outcome})
+        metrics.observe("scholarswipe_upstream_seconds", time.perf_counter() - start, {"model": model})
+
+async def search_papers(query: str) -> List[dict]:
+    """
+    Search for academic papers using Perplexity Sonar Search API.
+    Enhanced title extraction.
+    """
+    try:
+        search_query = f"""Find recent academic research papers about: {query}
+
+Focus on papers from trusted sources like:
+- arxiv.org
+- nature.com
+- science.org
+- ieee.org
+- acm.org
+- springer.com
+- scholar.google.com
+
+For each paper found, provide in this exact format:
+
+Title: [ACTUAL PAPER TITLE FROM THE SOURCE]
+URL: [full URL to the paper]
+Description: [2-3 sentence description]
+
+CRITICAL INSTRUCTIONS:
+1. Use the ACTUAL TITLE from the paper (not the URL, not "Research Paper")
+2. Look for the title in the page metadata, header, or citation
+3. Each title should be descriptive and specific to the paper's content
+4. Format each paper entry clearly with Title, URL, and Description labels
+
+Provide at least {SEARCH_CANDIDATES} relevant papers."""
+
+        # call Sonar model
+        response = await chat_completion(
+            stage="search",
+            model="sonar",
+            query=query,
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are an academic research assistant. Find relevant peer-reviewed papers and provide their EXACT TITLES as they appear on the source page, full URLs, and brief descriptions. Never use generic names like 'Research Paper' or URLs as titles. Always extract the real paper title."
+                },
+                {
+                    "role": "user",
+                    "content": search_query
+                }
+            ]
+        )
+
+        response_text = ""
+        try:
+            response_text = response.choices[0].message.content if hasattr(response, "choices") else str(response)
+        except Exception:
+            response_text = str(response)
+
+        # Attempt to extract structured citations
+        raw_citations = None
+        if hasattr(response, "citations"):
+            raw_citations = response.citations
+        else:
+            try:
+                maybe = getattr(response.choices[0].message, "citations", None)
+                if maybe:
+                    raw_citations = maybe
+            except Exception:
+                raw_citations = None
+
+        with metrics.timer("search_parse"):
+            unique_papers = sonar_parser.parse(response_text, raw_citations)
+
+        # If still no papers, create fallback with better titles
+        if not unique_papers:
+            logger.warning(f"No papers extracted, creating demo papers for: {query}")
+            metrics.inc("scholarswipe_fallbacks_total", {"kind": "demo_papers"})
+            unique_papers = [
+                {
+                    "title": f"A Comprehensive Survey of {query}: Recent Advances and Future Directions",
+                    "url": "https://arxiv.org/abs/2301.00000",
+                    "snippet": f"This survey paper provides a comprehensive overview of recent developments in {query}, analyzing current methodologies and future research directions.",
+                    "fallback": True
+                },
+                {
+                    "title": f"Deep Learning Approaches to {query}: Methods and Applications",
+                    "url": "https://ieeexplore.ieee.org/document/0000000",
+                    "snippet": f"An exploration of modern machine learning techniques applied to {query}, with practical implementations and case studies.",
+                    "fallback": True
+                },
+                {
+                    "title": f"The Impact of {query} on Contemporary Research: A Meta-Analysis",
+                    "url": "https://www.nature.com/articles/s41586-000-0000-0",
+                    "snippet": f"This meta-analysis examines the broader implications and research trends in {query} across multiple domains.",
+                    "fallback": True
+                }
+            ]
+
+        return dedupe_papers(unique_papers)[:SEARCH_CANDIDATES]
+
+    except (UpstreamUnavailable, BudgetExceeded):
+        raise
+    except TRANSIENT_ERRORS as e:
+        # Still failing after the scheduler's retries: not the same as no results
+        logger.warning(f"Search failed upstream: {e}")
+        raise
+    except Exception as e:
+        logger.exception(f"Error in search_papers: {e}")
+        return []
+
+async def generate_summary(paper: dict, query: str) -> PaperSummary:
+    """
+    Generate CONCISE structured summary using Sonar-Pro (under 200 words total)
+    Also attempts to get the actual paper title if needed
+    """
+    try:
+        # If title is generic, try to get actual title: locally first, and
+        # from the LLM only when every local step fails
+        current_title = paper.get('title', 'Unknown')
+        resolved_title = await title_resolver.resolve(paper) if is_generic_title(current_title) else None
+        if resolved_title:
+            current_title = resolved_title
+        elif is_generic_title(current_title) and not budget_plan(1)[2]:
+            # Low on budget: keep the generic title rather than pay for a call
+            metrics.inc("scholarswipe_budget_degradations_total", {"action": "skip_title_recovery"})
+        elif is_generic_title(current_title):
+            title_prompt = f"""
+            Based on this URL: {paper.get('url', '')}
+            And this description: {paper.get('snippet', '')}
+            
+            What is the actual title of this research paper? Provide ONLY the title, nothing else.
+            """
+            
+            try:
+                title_response = await chat_completion(
+                    stage="title_recovery",
+                    model="sonar",
+                    query=query,
+                    messages=[
+                        {"role": "system", "content": "You extract paper titles. Respond with ONLY the paper title, nothing else."},
+                        {"role": "user", "content": title_prompt}
+                    ]
+                )
+                extracted_title = title_response.choices[0].message.content.strip()
+                if extracted_title and len(extracted_title) > 10 and len(extracted_title) < 200:
+                    current_title = clean_title(extracted_title)
+            except:
+                pass
+            title_resolver.record_llm_fallback(not is_generic_title(current_title))
+        
+        prompt = f"""
+        Analyze this academic paper and provide a BRIEF structured summary in JSON format.
+        KEEP IT CONCISE - each field should be 1-2 sentences MAX.
+        
+        Title: {current_title}
+        URL: {paper.get('url', '')}
+        Description: {paper.get('snippet', 'No description available')}
+        
         Original research query: {query}
         
-        Create a JSON object with these exact fields (KEEP BRIEF):
-        {{
-            "title": "{current_title}",
-            "key_findings": "1-2 sentences about main findings",
-            "methodology": "1 sentence about research methods",
-            "limitations": "1 sentence about limitations",
-            "summary": "2 sentences overall summary",
-            "relevance_score": 85,
-            "authenticity_score": 90
-        }}
+        Create a JSON object with these exact fields (KEEP BRIEF):
+        {{
+            "title": "{current_title}",
+            "key_findings": "1-2 sentences about main findings",
+            "methodology": "1 sentence about research methods",
+            "limitations": "1 sentence about limitations",
+            "summary": "2 sentences overall summary",
+            "relevance_score": 85,
+            "authenticity_score": 90
+        }}
+        
+        IMPORTANT: Keep each field SHORT and CONCISE. Total response should be under 200 words.
+        
+        For relevance_score (0-100): How relevant is this paper to "{query}"?
+        For authenticity_score (0-100): How credible is this source?
+        
+        Return ONLY valid JSON, no other text.
+        """
+        
+        response = await chat_completion(
+            stage="summary",
+            model="sonar-pro",
+            query=query,
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are an expert academic research analyst. Provide CONCISE, structured summaries in JSON format. Keep responses brief and under 200 words total."
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+        )
+        
+        with metrics.timer("summary_parse"):
+            fields, missing = summary_extractor.parse_summary(response.choices[0].message.content or '', current_title)
+
+        # Keep what the reply got right and ask only for what it did not
+        if missing:
+            fields.update(await complete_summary_fields(paper, query, fields, missing))
+            missing = [field for field in missing if field not in fields]
+        if missing:
+            logger.warning(f"Summary for {paper.get('url', '')} still missing {', '.join(missing)}")
+            return default_summary(paper, query)
+        return PaperSummary(**fields)
+
+    except (UpstreamUnavailable, BudgetExceeded) + TRANSIENT_ERRORS as e:
+        logger.warning(f"Error generating summary: {e}")
+        return default_summary(paper, query)
+    except Exception as e:
+        logger.exception(f"Error generating summary: {e}")
+        return default_summary(paper, query)
+
+async def complete_summary_fields(paper: dict, query: str, known: dict, missing: List[str]) -> dict:
+    """
+    Cheap sonar follow-up for the fields a sonar-pro summary reply lacked.
+    Returns whichever of them it could get (possibly none).
+    """
+    described = "\n".join(f"{field}: {value}" for field, value in known.items())
+    wanted = ", ".join(f'"{field}"' for field in missing)
+    prompt = f"""
+    Paper: {known.get('title') or paper.get('title', 'Unknown')}
+    URL: {paper.get('url', '')}
+    Description: {paper.get('snippet', 'No description available')}
+    Research query: {query}
+
+    Already known about this paper:
+    {described or 'nothing'}
+
+    Return ONLY a JSON object with exactly these fields: {wanted}.
+    Text fields are 1-2 sentences. relevance_score (how relevant to the query)
+    and authenticity_score (how credible the source) are integers 0-100.
+    """
+    try:
+        response = await chat_completion(
+            stage="summary_repair",
+            model="sonar",
+            query=query,
+            messages=[
+                {"role": "system", "content": "You complete partial research paper summaries. Respond with ONLY a JSON object."},
+                {"role": "user", "content": prompt}
+            ]
+        )
+        fields, _ = summary_extractor.parse_summary(response.choices[0].message.content or '')
+    except Exception as e:
+        logger.warning(f"Summary follow-up failed: {e}")
+        fields = {}
+    completed = {field: fields[field] for field in missing if field in fields}
+    metrics.inc("scholarswipe_summary_repairs_total", {"outcome": "complete" if len(completed) == len(missing) else "partial"})
+    return completed
+
+async def generate_summaries_batch(papers: List[dict], query: str) -> List[PaperSummary]:
+    """
+    Summarize several papers with ONE sonar-pro request that returns a JSON
+    array of summaries. Entries that are missing or fail validation are
+    retried with generate_summary() one paper at a time; the rest of the
+    batch is kept. Over budget or with the circuit open every paper gets
+    default_summary(), since each retry would be refused the same way.
+    """
+    # Give the model real titles where they can be found locally
+    papers = [
+        dict(paper, title=await title_resolver.resolve(paper) or paper.get('title', 'Unknown'))
+        if is_generic_title(paper.get('title')) else paper
+        for paper in papers
+    ]
+    papers_text = "\n\n".join(
+        f"Paper {i + 1}:\n"
+        f"Title: {paper.get('title', 'Unknown')}\n"
+        f"URL: {paper.get('url', '')}\n"
+        f"Description: {paper.get('snippet') or 'No description available'}"
+        for i, paper in enumerate(papers)
+    )
+
+    prompt = f"""
+    Analyze these {len(papers)} academic papers and provide a BRIEF structured summary of each in JSON format.
+    KEEP IT CONCISE - each field should be 1-2 sentences MAX.
+
+    {papers_text}
+
+    Original research query: {query}
+
+    Return a JSON array with exactly {len(papers)} objects, one per paper, in the same order.
+    Each object must have these exact fields (KEEP BRIEF):
+    {{
+        "index": 1,
+        "title": "actual paper title",
+        "key_findings": "1-2 sentences about main findings",
+        "methodology": "1 sentence about research methods",
+        "limitations": "1 sentence about limitations",
+        "summary": "2 sentences overall summary",
+        "relevance_score": 85,
+        "authenticity_score": 90
+    }}
+
+    "index" is the paper number above. If a listed title is generic or a URL, give the actual paper title.
+    For relevance_score (0-100): How relevant is the paper to "{query}"?
+    For authenticity_score (0-100): How credible is the source?
+
+    Return ONLY the JSON array, no other text.
+    """
+
+    entries: List = []
+    try:
+        response = await chat_completion(
+            stage="batch_summary",
+            model="sonar-pro",
+            query=query,
+            units=len(papers),
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are an expert academic research analyst. Provide CONCISE, structured summaries as a JSON array. Keep each summary under 200 words."
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+        )
+        with metrics.timer("batch_summary_parse"):
+            parsed = summary_extractor.loads(response.choices[0].message.content or '', '[')
+            if isinstance(parsed, list):
+                entries = parsed
+    except (UpstreamUnavailable, BudgetExceeded) as e:
+        logger.warning(f"Error generating batch summary: {e}")
+        return [default_summary(paper, query) for paper in papers]
+    except Exception as e:
+        logger.exception(f"Error generating batch summary: {e}")
+
+    # Match entries to papers by their "index", falling back to position
+    by_position: dict = {}
+    for position, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            continue
+        index = entry.get('index')
+        if not isinstance(index, int) or not 1 <= index <= len(papers) or (index - 1) in by_position:
+            index = position + 1
+        by_position.setdefault(index - 1, entry)
+
+    summaries: List[Optional[PaperSummary]] = [
+        summary_from_entry(by_position.get(i)) for i in range(len(papers))
+    ]
+    retry = [i for i, summary in enumerate(summaries) if summary is None]
+    if retry:
+        logger.warning(f"Batch summary incomplete, retrying {len(retry)} of {len(papers)} papers individually")
+        retried = await asyncio.gather(*(generate_summary(papers[i], query) for i in retry))
+        for i, summary in zip(retry, retried):
+            summaries[i] = summary
+    return summaries
+
+def summary_from_entry(entry: Optional[dict]) -> Optional[PaperSummary]:
+    """Validate one batch entry into a PaperSummary, or None if unusable"""
+    fields, missing = summary_extractor.validate(entry)
+    return None if missing else PaperSummary(**fields)
+
+def default_summary(paper: dict, query: str) -> PaperSummary:
+    """Fallback summary used when the Sonar-Pro summary is unavailable"""
+    summary = PaperSummary(
+        title=clean_title(paper.get('title', 'Unknown')),
+        key_findings="Summary unavailable: the paper could not be analysed right now.",
+        methodology="Not analysed.",
+        limitations="Not analysed.",
+        summary=(paper.get('snippet') or "No summary available.")[:100],
+        relevance_score=0,
+        authenticity_score=0,
+        fallback=True
+    )
+    metrics.inc("scholarswipe_fallbacks_total", {"kind": "default_summary"})
+    return summary
+
+async def fetch_papers(query: str) -> List[dict]:
+    """
+    search_papers() behind the level 1 (normalized query) cache; concurrent
+    misses for the same normalized query share one upstream search. The
+    cached candidates are re-ranked locally and cut to RERANK_TOP_N.
+    """
+    key = normalize_query(query)
+    cached = await search_cache.get(key)
+    if cached is not None:
+        return rank_candidates([dict(p) for p in cached], query)
+
+    async def load() -> List[dict]:
+        papers = await search_papers(query)
+        # Demo papers are a fallback, not a real result worth keeping
+        if papers and not any(p.get('fallback') for p in papers):
+            await search_cache.set(key, papers)
+        return papers
+
+    papers = await shared_flight(search_flight, key, load)
+    return rank_candidates([dict(p) for p in papers], query)
+
+def rank_candidates(papers: List[dict], query: str) -> List[dict]:
+    """
+    Keep the locally best-scoring candidates so only those reach sonar-pro;
+    fewer than RERANK_TOP_N when the request's budget cannot cover them all
+    """
+    top_n = budget_plan(RERANK_TOP_N)[0]
+    if top_n < RERANK_TOP_N:
+        metrics.inc("scholarswipe_budget_degradations_total", {"action": "fewer_papers"})
+    if any(p.get('fallback') for p in papers):
+        return papers[:top_n]
+    with metrics.timer("rerank"):
+        return relevance_ranker.rank(papers, query, top_n, RERANK_MIN_SCORE)
+
+async def fetch_summary(paper: dict, query: str) -> PaperSummary:
+    """
+    generate_summary() behind the level 2 (paper URL, query) cache; concurrent
+    misses for the same key share one upstream summary
+    """
+    key = summary_cache_key(paper, query)
+    cached = await summary_cache.get(key)
+    if cached is not None:
+        return PaperSummary(**cached)
+
+    async def load() -> PaperSummary:
+        # A paper summarized for another query only needs a new relevance score
+        summary = await summary_from_store(paper, query)
+        if summary is None:
+            summary = await generate_summary(paper, query)
+        await store_summary(key, paper, summary)
+        return summary
+
+    return await shared_flight(summary_flight, key, load)
+
+async def fetch_summaries_batch(papers: List[dict], query: str) -> List[PaperSummary]:
+    """generate_summaries_batch() for only the papers missing from the level 2 cache"""
+    keys = [summary_cache_key(paper, query) for paper in papers]
+    summaries: List[Optional[PaperSummary]] = []
+    for key in keys:
+        cached = await summary_cache.get(key)
+        summaries.append(PaperSummary(**cached) if cached is not None else None)
+
+    # Papers already being summarized by another request join that work, and
+    # papers in the paper store only need their relevance rescored
+    joining = [i for i, summary in enumerate(summaries) if summary is None and summary_flight.in_flight(keys[i])]
+    unclaimed = [i for i, summary in enumerate(summaries) if summary is None and i not in joining]
+    if paper_store is not None and unclaimed:
+        try:
+            stored = await asyncio.to_thread(lambda: [i for i in unclaimed if paper_store.get(papers[i].get('url', ''))])
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read paper store: {e}")
+            stored = []
+        joining.extend(stored)
+    missing = [i for i, summary in enumerate(summaries) if summary is None and i not in joining]
+    if joining:
+        joined = await asyncio.gather(*(fetch_summary(papers[i], query) for i in joining))
+        for i, summary in zip(joining, joined):
+            summaries[i] = summary
+
+    if len(missing) == 1:
+        summaries[missing[0]] = await fetch_summary(papers[missing[0]], query)
+    elif missing:
+        index_of = {keys[i]: i for i in missing}
+
+        # Concurrent identical requests join this batch key by key
+        async def load(led_keys: List[str]) -> List[PaperSummary]:
+            led = [index_of[key] for key in led_keys]
+            generated = await generate_summaries_batch([papers[i] for i in led], query)
+            for i, summary in zip(led, generated):
+                await store_summary(keys[i], papers[i], summary)
+            return generated
+
+        generated = dict(zip(index_of, await shared_flight_many(summary_flight, list(index_of), load)))
+        for i in missing:
+            summaries[i] = generated[keys[i]]
+    return summaries
+
+async def store_summary(key: str, paper: dict, summary: PaperSummary):
+    """
+    Keep a real (non-fallback) summary in the level 2 cache, its title in the
+    title index and its query-independent fields in the paper store
+    """
+    if summary.fallback or not paper.get('url'):
+        return
+    await summary_cache.set(key, summary.model_dump())
+
+    def persist():
+        title_resolver.remember(paper['url'], summary.title)
+        if paper_store is not None:
+            try:
+                paper_store.save(paper, summary)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not update paper store: {e}")
+
+    # Both commit to SQLite, so they run in a worker thread
+    await asyncio.to_thread(persist)
+
+async def summary_from_store(paper: dict, query: str) -> Optional[PaperSummary]:
+    """
+    Rebuild a summary from the paper store, asking sonar only for this
+    query's relevance_score. None when the paper is not stored or the
+    rescoring fails.
+    """
+    if paper_store is None:
+        return None
+    try:
+        stored = await asyncio.to_thread(paper_store.get, paper.get('url', ''))
+    except sqlite3.Error as e:
+        logger.warning(f"Could not read paper store: {e}")
+        return None
+    if not stored:
+        return None
+
+    prompt = f"""
+    Paper title: {stored['title']}
+    Summary: {stored['summary']}
+    Key findings: {stored['key_findings']}
+
+    Research query: {query}
+
+    On a scale of 0-100, how relevant is this paper to the research query?
+    Respond with ONLY the number.
+    """
+    try:
+        response = await chat_completion(
+            stage="relevance",
+            model="sonar",
+            query=query,
+            messages=[
+                {"role": "system", "content": "You rate how relevant a research paper is to a query. Respond with ONLY an integer from 0 to 100."},
+                {"role": "user", "content": prompt}
+            ]
+        )
+        match = re.search(r'\d{1,3}', response.choices[0].message.content or '')
+        if not match:
+            return None
+        relevance = max(0, min(100, int(match.group(0))))
+    except Exception as e:
+        logger.warning(f"Error rescoring stored paper: {e}")
+        return None
+
+    metrics.inc("scholarswipe_paper_store_reuse_total")
+    return PaperSummary(
+        title=stored['title'],
+        relevance_score=relevance,
+        **{field: stored[field] for field in STORED_SUMMARY_FIELDS}
+    )
+
+async def summarize_batch_with_timeout(raw_papers: List[dict], query: str) -> List[PaperSummary]:
+    """fetch_summaries_batch() bounded by SUMMARY_TIMEOUT, falling back to default summaries"""
+    try:
+        return await asyncio.wait_for(fetch_summaries_batch(raw_papers, query), timeout=SUMMARY_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Batch summary timed out after {SUMMARY_TIMEOUT}s ({len(raw_papers)} papers)")
+    except Exception as e:
+        logger.warning(f"Error summarizing batch: {e}")
+    return [default_summary(raw_paper, query) for raw_paper in raw_papers]
+
+async def summarize_with_timeout(raw_paper: dict, query: str) -> PaperSummary:
+    """fetch_summary() bounded by SUMMARY_TIMEOUT, falling back to the default summary"""
+    try:
+        return await asyncio.wait_for(fetch_summary(raw_paper, query), timeout=SUMMARY_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Summary timed out after {SUMMARY_TIMEOUT}s: {raw_paper.get('url', '')}")
+    except Exception as e:
+        logger.warning(f"Error summarizing paper: {e}")
+    return default_summary(raw_paper, query)
+
+async def iter_summaries(raw_papers: List[dict], query: str) -> AsyncIterator[Tuple[int, PaperSummary]]:
+    """
+    Summarize papers concurrently, at most SUMMARY_CONCURRENCY requests at a
+    time, and yield (index, summary) pairs in completion order. Papers are
+    grouped SUMMARY_BATCH_SIZE per request (more when the budget runs low).
+    A paper that fails or exceeds SUMMARY_TIMEOUT gets the default summary
+    instead of holding up the rest. Pending work is cancelled if the
+    consumer stops early.
+    """
+    semaphore = asyncio.Semaphore(max(1, SUMMARY_CONCURRENCY))
+    batch_size = budget_plan(len(raw_papers))[1]
+    if batch_size > max(1, SUMMARY_BATCH_SIZE) and len(raw_papers) > 1:
+        metrics.inc("scholarswipe_budget_degradations_total", {"action": "batched_summaries"})
+
+    async def summarize_group(indices: List[int]) -> List[Tuple[int, PaperSummary]]:
+        async with semaphore:
+            if len(indices) == 1:
+                summaries = [await summarize_with_timeout(raw_papers[indices[0]], query)]
+            else:
+                summaries = await summarize_batch_with_timeout([raw_papers[i] for i in indices], query)
+            return list(zip(indices, summaries))
+
+    groups = [
+        list(range(start, min(start + batch_size, len(raw_papers))))
+        for start in range(0, len(raw_papers), batch_size)
+    ]
+    tasks = [asyncio.ensure_future(summarize_group(group)) for group in groups]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for result in await next_done:
+                yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def summarize_papers(raw_papers: List[dict], query: str) -> List[PaperSummary]:
+    """Summarize papers concurrently; results keep the order of raw_papers"""
+    summaries: List[Optional[PaperSummary]] = [None] * len(raw_papers)
+    async for index, summary in iter_summaries(raw_papers, query):
+        summaries[index] = summary
+    return summaries
+
+def build_paper(raw_paper: dict, summary: PaperSummary) -> Paper:
+    """Combine a raw search result with its summary into a Paper card"""
+    return Paper(
+        title=summary.title,  # Use title from summary which may be improved
+        url=raw_paper.get('url', ''),
+        snippet=raw_paper.get('snippet'),
+        abstract=raw_paper.get('snippet'),
+        summary=summary,
+        fallback=bool(raw_paper.get('fallback')) or summary.fallback
+    )
+
+# =====================
+# Search sessions
+# =====================
+
+class SearchSession:
+    """
+    Paper list for one query whose summaries are generated only when a card
+    is requested (plus PREFETCH_AHEAD cards after it). Each summary is
+    started at most once and shared by every request for that index.
+    """
+
+    def __init__(self, session_id: str, query: str, raw_papers: List[dict]):
+        self.session_id = session_id
+        self.query = query
+        self.raw_papers = raw_papers
+        self._tasks: dict = {}
+        self._semaphore = asyncio.Semaphore(max(1, SUMMARY_CONCURRENCY))
+
+    def summary_task(self, index: int) -> asyncio.Task:
+        task = self._tasks.get(index)
+        if task is None or task.cancelled():
+            task = asyncio.ensure_future(self._summarize(index))
+            self._tasks[index] = task
+        return task
+
+    async def _summarize(self, index: int) -> PaperSummary:
+        async with self._semaphore:
+            return await summarize_with_timeout(self.raw_papers[index], self.query)
+
+    def prefetch(self, index: int, ahead: int):
+        for next_index in range(index + 1, min(index + 1 + ahead, len(self.raw_papers))):
+            self.summary_task(next_index)
+
+    def cancel(self):
+        for task in self._tasks.values():
+            task.cancel()
+
+# Sessions expire SESSION_TTL seconds after their last use
+SESSION_TTL = float(os.getenv("SCHOLARSWIPE_SESSION_TTL", "1800"))
+SESSION_MAX_ENTRIES = int(os.getenv("SCHOLARSWIPE_SESSION_MAX_ENTRIES", "1000"))
+PREFETCH_AHEAD = int(os.getenv("SCHOLARSWIPE_PREFETCH_AHEAD", "2"))
+
+session_store = TTLCache(SESSION_MAX_ENTRIES, SESSION_TTL)
+
+async def save_session(session: SearchSession):
+    session_store.set(session.session_id, session)
+    # Other workers rebuild the session from its query and paper list
+    if shared_cache is not None:
+        await shared_cache_call(shared_cache, "set", "session", session.session_id,
+                                 {"query": session.query, "raw_papers": session.raw_papers}, SESSION_TTL)
+
+async def get_session(session_id: str) -> SearchSession:
+    session = session_store.get(session_id)
+    if session is None and shared_cache is not None:
+        shared = await shared_cache_call(shared_cache, "get", "session", session_id)
+        if shared is not None:
+            session = SearchSession(session_id, shared["query"], shared["raw_papers"])
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    # Sliding expiry: every use restarts the TTL
+    await save_session(session)
+    return session
+
+# =====================
+# Conclusion synthesis
+# =====================
+
+# Liked-paper lists whose prompt would exceed CONCLUSION_GROUP_TOKENS are
+# synthesized map-reduce style: token-budgeted groups are summarized
+# concurrently (and cached), then the partial syntheses are combined.
+CONCLUSION_GROUP_TOKENS = int(os.getenv("SCHOLARSWIPE_CONCLUSION_GROUP_TOKENS", "3000"))
+CONCLUSION_CACHE_TTL = float(os.getenv("SCHOLARSWIPE_CONCLUSION_CACHE_TTL", "86400"))
+CONCLUSION_CACHE_MAX_ENTRIES = int(os.getenv("SCHOLARSWIPE_CONCLUSION_CACHE_MAX_ENTRIES", "2000"))
+
+conclusion_group_cache = ResponseCache("conclusion_group", CONCLUSION_CACHE_MAX_ENTRIES, CONCLUSION_CACHE_TTL, shared_cache)
+conclusion_flight = SingleFlight("conclusion_group")
+
+CONCLUSION_SYSTEM_PROMPT = "You are an expert academic writer. Synthesize multiple research papers into a cohesive summary that helps students understand the research landscape."
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+def conclusion_entry(paper: Paper) -> str:
+    return (
+        f"{paper.title}\n"
+        f"Summary: {paper.summary.summary if paper.summary else 'N/A'}\n"
+        f"Key Findings: {paper.summary.key_findings if paper.summary else 'N/A'}"
+    )
+
+def chunk_by_tokens(entries: List[str], budget: int) -> List[List[str]]:
+    """
+    Split entries, in order, into groups of at most `budget` estimated tokens.
+    Appending entries only changes the last group(s), so earlier groups keep
+    their cache keys.
+    """
+    groups: List[List[str]] = []
+    current: List[str] = []
+    current_tokens = 0
+    for entry in entries:
+        tokens = estimate_tokens(entry)
+        if current and current_tokens + tokens > budget:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(entry)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+def conclusion_prompt(total_papers: int, material_heading: str, material: str) -> str:
+    return f"""
+        Based on these {total_papers} research papers, write a comprehensive summary
+        that synthesizes the research topic (2-3 paragraphs):
+        
+        1. Provide an overview of the research area and what these papers collectively explore
+        2. Identify common themes, methodologies, and key insights across the papers
+        3. Note the overall significance and future directions in this field
         
-        IMPORTANT: Keep each field SHORT and CONCISE. Total response should be under 200 words.
+        {material_heading}
+        {material}
         
-        For relevance_score (0-100): How relevant is this paper to "{query}"?
-        For authenticity_score (0-100): How credible is this source?
+        Write a cohesive academic summary that gives students a strong understanding of the 
+        overall research landscape on this topic. Keep it informative but accessible.
         
-        Return ONLY valid JSON, no other text.
+        IMPORTANT: 
+        - Do NOT include citations like [1], [2], etc.
+        - Do NOT use LaTeX formatting or special characters
+        - Do NOT use markdown formatting (**, ***, __, etc.)
+        - Write in plain text paragraphs only
+        - Make it readable and clear
+        - Use paragraphs if possible
         """
-        
-        response = client.chat.completions.create(
-            model="sonar-pro",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert academic research analyst. Provide CONCISE, structured summaries in JSON format. Keep responses brief and under 200 words total."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-        )
-        
-        import json
-        response_text = response.choices[0].message.content.strip()
-        if response_text.startswith("```"):
-            response_text = response_text.strip("`").replace("json\n", "").strip()
-        
-        summary_data = json.loads(response_text)
-        # Ensure title is clean
-        summary_data['title'] = clean_title(summary_data.get('title', current_title))
-        return PaperSummary(**summary_data)
-        
-    except Exception as e:
-        print(f"Error generating summary: {e}")
-        import traceback
-        traceback.print_exc()
-        return PaperSummary(
-            title=clean_title(paper.get('title', 'Unknown')),
-            key_findings=f"Explores key aspects of {query} with novel findings.",
-            methodology="Employs rigorous research methods and analysis.",
-            limitations="Further research may be needed.",
-            summary=paper.get('snippet', f"Research examining {query}.")[:100],
-            relevance_score=85,
-            authenticity_score=88
-        )
+
+async def synthesize_group(entries: List[str], semaphore: asyncio.Semaphore) -> str:
+    """Partial synthesis of one group, cached by the group's exact content"""
+    material = "\n\n".join(f"Item {i + 1}: {entry}" for i, entry in enumerate(entries))
+    key = hashlib.sha256(material.encode("utf-8")).hexdigest()
+    cached = await conclusion_group_cache.get(key)
+    if cached is not None:
+        return cached
+
+    async def load() -> str:
+        prompt = f"""
+        These {len(entries)} items are research papers (or partial syntheses of groups of papers)
+        from one literature review. Write ONE dense paragraph that captures what they collectively
+        explore: the shared themes, the methodologies used, the key findings, and any disagreements
+        or open questions. Keep every concrete insight; drop repetition.
+
+        {material}
+
+        Plain text only: no citations, no markdown, no LaTeX.
+        """
+        async with semaphore:
+            response = await chat_completion(
+                stage="conclusion_group",
+                model="sonar-pro",
+                messages=[
+                    {"role": "system", "content": CONCLUSION_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ]
+            )
+        partial = response.choices[0].message.content.strip()
+        await conclusion_group_cache.set(key, partial)
+        return partial
+
+    return await shared_flight(conclusion_flight, key, load)
+
+async def synthesize_conclusion(papers: List[Paper]) -> str:
+    """
+    Conclusion text for a liked-paper list. Small lists use one sonar-pro
+    call; larger ones are reduced group by group until the material fits in
+    CONCLUSION_GROUP_TOKENS, then written up in one final call.
+    """
+    entries = [conclusion_entry(paper) for paper in papers]
+    budget = max(500, CONCLUSION_GROUP_TOKENS)
+    heading = "Papers reviewed:"
+    material = "\n\n".join(f"Paper {i + 1}: {entry}" for i, entry in enumerate(entries))
+
+    if estimate_tokens(material) > budget:
+        semaphore = asyncio.Semaphore(max(1, SUMMARY_CONCURRENCY))
+        partials = entries
+        while len(partials) > 1 and estimate_tokens("\n\n".join(partials)) > budget:
+            groups = chunk_by_tokens(partials, budget)
+            if len(groups) == len(partials):
+                # Every item already fills a group on its own; pair them up
+                groups = [partials[i:i + 2] for i in range(0, len(partials), 2)]
+            with metrics.timer("conclusion_map"):
+                partials = list(await asyncio.gather(*(synthesize_group(g, semaphore) for g in groups)))
+        heading = "Syntheses of the papers reviewed, each covering a group of them:"
+        material = "\n\n".join(f"Group {i + 1}: {partial}" for i, partial in enumerate(partials))
+
+    response = await chat_completion(
+        stage="conclusion",
+        model="sonar-pro",
+        messages=[
+            {"role": "system", "content": CONCLUSION_SYSTEM_PROMPT},
+            {"role": "user", "content": conclusion_prompt(len(papers), heading, material)}
+        ]
+    )
+    return response.choices[0].message.content
+
+# =====================
+# Bibliography export
+# =====================
+
+# Formatted entries are cached per (style, paper, access date), so exporting
+# the same library again only joins strings
+BIBLIOGRAPHY_CACHE_MAX_ENTRIES = int(os.getenv("SCHOLARSWIPE_BIBLIOGRAPHY_CACHE_MAX_ENTRIES", "5000"))
+# Entries per chunk of a streamed export
+BIBLIOGRAPHY_CHUNK_ENTRIES = int(os.getenv("SCHOLARSWIPE_BIBLIOGRAPHY_CHUNK_ENTRIES", "200"))
+
+bibliography_cache = TTLCache(BIBLIOGRAPHY_CACHE_MAX_ENTRIES, 24 * 3600)
+
+# style -> (display name, media type, file extension)
+BIBLIOGRAPHY_STYLES = {
+    "harvard": ("Harvard", "text/plain", "txt"),
+    "apa": ("APA", "text/plain", "txt"),
+    "bibtex": ("BibTeX", "application/x-bibtex", "bib"),
+    "ris": ("RIS", "application/x-research-info-systems", "ris"),
+}
+
+# Where a paper is hosted, by domain, for the container/publisher field.
+# DOI resolvers (doi.org, dx.doi.org) only redirect, so they give no container
+CONTAINER_NAMES = {
+    "doi.org": "",
+    "arxiv.org": "arXiv",
+    "nature.com": "Nature",
+    "science.org": "Science",
+    "ieeexplore.ieee.org": "IEEE Xplore",
+    "dl.acm.org": "ACM Digital Library",
+    "link.springer.com": "Springer",
+    "sciencedirect.com": "ScienceDirect",
+    "pubmed.ncbi.nlm.nih.gov": "PubMed",
+    "ncbi.nlm.nih.gov": "PubMed Central",
+}
+
+# arXiv ids start with YYMM (2301.00001) or end in YYMMNNN (hep-th/9901001);
+# Springer Nature DOIs embed the year as in s41586-023-06647-8
+_ARXIV_YEAR_RE = re.compile(r'^(\d{2})\d{2}\.|/(\d{2})\d{5}$')
+_SPRINGER_YEAR_RE = re.compile(r'/s\d{5}-0(\d{2})-')
+_BIBTEX_SPECIAL_RE = re.compile(r'([&%$#_{}])')
+
+def paper_metadata(paper: Paper) -> dict:
+    """
+    Citation metadata recoverable from the paper itself, without network
+    calls: arXiv id / DOI from the URL, publication year where the id
+    encodes it, and the hosting site
+    """
+    url = paper.url or ""
+    meta = {"title": paper.title or "Unknown Paper", "url": url, **extract_paper_ids(url)}
+
+    yy = None
+    if 'arxiv' in meta:
+        match = _ARXIV_YEAR_RE.search(meta['arxiv'])
+        yy = match and (match.group(1) or match.group(2))
+    elif 'doi' in meta:
+        match = _SPRINGER_YEAR_RE.search(meta['doi'])
+        yy = match and match.group(1)
+    if yy:
+        meta['year'] = (1900 if int(yy) >= 90 else 2000) + int(yy)
+
+    host = urlsplit(url).netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    meta['container'] = next(
+        (name for domain, name in CONTAINER_NAMES.items() if host == domain or host.endswith('.' + domain)),
+        host
+    )
+    return meta
+
+def format_harvard(meta: dict, accessed: date) -> str:
+    identifier = f" doi:{meta['doi']}." if 'doi' in meta else (f" arXiv:{meta['arxiv']}." if 'arxiv' in meta else "")
+    container = f" {meta['container']}." if meta['container'] else ""
+    return (
+        f"{meta['title']} ({meta.get('year', 'n.d.')}).{container}{identifier}"
+        f" Available at: {meta['url']} (Accessed: {accessed.strftime('%d %B %Y')})."
+    )
+
+def format_apa(meta: dict, accessed: date) -> str:
+    # No author known: APA 7 moves the title into the author position
+    container = f" {meta['container']}." if meta['container'] else ""
+    if 'arxiv' in meta:
+        container = f" arXiv. arXiv:{meta['arxiv']}."
+    link = f"https://doi.org/{meta['doi']}" if 'doi' in meta else meta['url']
+    return f"{meta['title']}. ({meta.get('year', 'n.d.')}).{container} {link}"
+
+def bibtex_escape(value: str) -> str:
+    return _BIBTEX_SPECIAL_RE.sub(r'\\\1', value)
+
+def bibtex_key(meta: dict) -> str:
+    """First significant title word + year + a short hash of the paper id, e.g. protein2023a1f0"""
+    words = [w for w in rank_terms(meta['title']) if w.isalpha()]
+    digest = hashlib.sha1(canonical_paper_id(meta['url']).encode("utf-8")).hexdigest()[:4]
+    return f"{words[0] if words else 'paper'}{meta.get('year', '')}{digest}"
+
+def format_bibtex(meta: dict, accessed: date) -> str:
+    fields = [("title", "{" + bibtex_escape(meta['title']) + "}")]
+    if 'year' in meta:
+        fields.append(("year", str(meta['year'])))
+    if 'arxiv' in meta:
+        fields += [("eprint", meta['arxiv']), ("archivePrefix", "arXiv")]
+    elif meta['container']:
+        fields.append(("journal" if 'doi' in meta else "howpublished", bibtex_escape(meta['container'])))
+    if 'doi' in meta:
+        fields.append(("doi", meta['doi']))
+    fields += [("url", meta['url']), ("urldate", accessed.isoformat())]
+    entry_type = "article" if 'doi' in meta and 'arxiv' not in meta else "misc"
+    body = ",\n".join(f"  {name} = {{{value}}}" for name, value in fields)
+    return f"@{entry_type}{{{bibtex_key(meta)},\n{body}\n}}"
+
+def format_ris(meta: dict, accessed: date) -> str:
+    entry_type = "JOUR" if 'doi' in meta else ("UNPB" if 'arxiv' in meta else "ELEC")
+    lines = [("TY", entry_type), ("TI", meta['title'])]
+    if 'year' in meta:
+        lines.append(("PY", str(meta['year'])))
+    if meta['container']:
+        lines.append(("T2" if 'doi' in meta else "PB", meta['container']))
+    if 'doi' in meta:
+        lines.append(("DO", meta['doi']))
+    if 'arxiv' in meta:
+        lines.append(("AN", f"arXiv:{meta['arxiv']}"))
+    lines += [("UR", meta['url']), ("Y2", accessed.strftime('%Y/%m/%d')), ("ER", "")]
+    return "\n".join(f"{tag}  - {' '.join(value.split())}" for tag, value in lines)
+
+BIBLIOGRAPHY_FORMATTERS = {
+    "harvard": format_harvard,
+    "apa": format_apa,
+    "bibtex": format_bibtex,
+    "ris": format_ris,
+}
+
+def bibliography_entry(paper: Paper, style: str, accessed: date) -> str:
+    """One formatted entry, from the per-paper cache when possible"""
+    key = f"{style}\n{canonical_paper_id(paper.url or '')}\n{paper.title}\n{accessed.isoformat()}"
+    entry = bibliography_cache.get(key)
+    if entry is None:
+        metrics.inc("scholarswipe_cache_lookups_total", {"cache": "bibliography", "result": "miss", "tier": "all"})
+        entry = BIBLIOGRAPHY_FORMATTERS[style](paper_metadata(paper), accessed)
+        bibliography_cache.set(key, entry)
+    else:
+        metrics.inc("scholarswipe_cache_lookups_total", {"cache": "bibliography", "result": "hit", "tier": "local"})
+    return entry
+
+def iter_bibliography(papers: List[Paper], style: str) -> Iterator[str]:
+    """Entries in order, separated by blank lines; Harvard entries are numbered"""
+    accessed = date.today()
+    for i, paper in enumerate(papers, 1):
+        entry = bibliography_entry(paper, style, accessed)
+        if style == "harvard":
+            entry = f"{i}. {entry}"
+        yield entry if i == 1 else "\n\n" + entry
+
+async def stream_bibliography(papers: List[Paper], style: str) -> AsyncIterator[str]:
+    """iter_bibliography in chunks of BIBLIOGRAPHY_CHUNK_ENTRIES, ending with a newline"""
+    chunk: List[str] = []
+    for entry in iter_bibliography(papers, style):
+        chunk.append(entry)
+        if len(chunk) >= max(1, BIBLIOGRAPHY_CHUNK_ENTRIES):
+            yield "".join(chunk)
+            chunk = []
+    chunk.append("\n")
+    yield "".join(chunk)
+
+# =====================
+# Deep search jobs
+# =====================
+
+# Deep searches run as background jobs: the query is split into sub-queries,
+# JOB_WORKERS workers search and summarize them, and every finished card is
+# written to SQLite so progress survives a dropped connection
+JOB_STORE_PATH = os.getenv("SCHOLARSWIPE_JOB_STORE_PATH", "scholarswipe.db")
+JOB_WORKERS = int(os.getenv("SCHOLARSWIPE_JOB_WORKERS", "3"))
+JOB_SUB_QUERIES = int(os.getenv("SCHOLARSWIPE_JOB_SUB_QUERIES", "6"))
+JOB_MAX_PAPERS = int(os.getenv("SCHOLARSWIPE_JOB_MAX_PAPERS", "100"))
+JOB_MAX_PER_USER = int(os.getenv("SCHOLARSWIPE_JOB_MAX_PER_USER", "2"))
+# Most exclude_urls one job request may pass
+JOB_MAX_EXCLUDED = 1000
+# Finished jobs (and their papers) are deleted after this many seconds
+JOB_RETENTION = float(os.getenv("SCHOLARSWIPE_JOB_RETENTION", str(7 * 24 * 3600)))
+
+# Running jobs touch their record this often; one untouched for
+# JOB_STALE_AFTER belongs to a worker that died
+JOB_HEARTBEAT = float(os.getenv("SCHOLARSWIPE_JOB_HEARTBEAT", "5"))
+JOB_STALE_AFTER = 6 * JOB_HEARTBEAT
+
+JOB_ACTIVE_STATES = ("queued", "planning", "running")
+
+# Set to 1 only when a proxy or auth layer in front of the app sets X-User-Id
+# itself. Otherwise any client can send a fresh id with every request, so the
+# header only labels usage and owns jobs, and per-user limits (budget, job
+# cap) apply to the client address
+TRUST_USER_ID_HEADER = os.getenv("SCHOLARSWIPE_TRUST_USER_ID_HEADER", "0") == "1"
+
+def client_id(request: Request) -> str:
+    """Who a request is from: the X-User-Id header, else the client address"""
+    user = request.headers.get("x-user-id", "").strip()
+    if user:
+        return user[:128]
+    return request.client.host if request.client else "anonymous"
+
+def client_limit_key(request: Request) -> str:
+    """Who per-user limits apply to: client_id() if the header is trusted, else the client address"""
+    if TRUST_USER_ID_HEADER:
+        return client_id(request)
+    return request.client.host if request.client else "anonymous"
+
+class JobStore:
+    """Job records and their summarized papers, in completion order"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        with self._lock, self._conn:
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, query TEXT NOT NULL,"
+                " status TEXT NOT NULL, sub_queries TEXT NOT NULL DEFAULT '[]',"
+                " papers_found INTEGER NOT NULL DEFAULT 0, error TEXT,"
+                " cancel_requested INTEGER NOT NULL DEFAULT 0,"
+                " created_at REAL NOT NULL, updated_at REAL NOT NULL, client TEXT NOT NULL DEFAULT '')"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            if "cancel_requested" not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0")
+            # Who the job cap applies to (see client_limit_key)
+            if "client" not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN client TEXT NOT NULL DEFAULT ''")
+                self._conn.execute("UPDATE jobs SET client = user_id")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_papers ("
+                " job_id TEXT NOT NULL, position INTEGER NOT NULL, paper TEXT NOT NULL,"
+                " PRIMARY KEY (job_id, position))"
+            )
+        self.mark_stale()
+
+    def mark_stale(self):
+        """Jobs whose worker stopped heartbeating (the process died) will never finish"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE jobs SET status = 'interrupted', updated_at = ?"
+                f" WHERE updated_at < ? AND status IN ({', '.join('?' * len(JOB_ACTIVE_STATES))})",
+                (now, now - JOB_STALE_AFTER, *JOB_ACTIVE_STATES)
+            )
+
+    def touch(self, job_id: str) -> bool:
+        """Heartbeat for a running job; True if cancellation was requested meanwhile"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET updated_at = ? WHERE job_id = ?", (time.time(), job_id))
+            row = self._conn.execute("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def request_cancel(self, job_id: str):
+        """Ask whichever worker runs the job to cancel it"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE job_id = ?", (job_id,))
+
+    def active_count(self, client: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM jobs WHERE client = ?"
+                f" AND status IN ({', '.join('?' * len(JOB_ACTIVE_STATES))})",
+                (client, *JOB_ACTIVE_STATES)
+            ).fetchone()[0]
+
+    def create(self, job_id: str, user_id: str, query: str, sub_queries: List[str], client: Optional[str] = None):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, user_id, query, status, sub_queries, created_at, updated_at, client)"
+                " VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, user_id, query, json.dumps(sub_queries), now, now, user_id if client is None else client)
+            )
+
+    def update(self, job_id: str, status: Optional[str] = None, sub_queries: Optional[List[str]] = None,
+               papers_found: Optional[int] = None, error: Optional[str] = None):
+        fields = {"status": status, "papers_found": papers_found, "error": error,
+                  "sub_queries": json.dumps(sub_queries) if sub_queries is not None else None}
+        fields = {name: value for name, value in fields.items() if value is not None}
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ? WHERE job_id = ?",
+                (*fields.values(), time.time(), job_id)
+            )
+
+    def add_paper(self, job_id: str, paper: Paper):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO job_papers (job_id, position, paper) VALUES"
+                " (?, (SELECT COUNT(*) FROM job_papers WHERE job_id = ?), ?)",
+                (job_id, job_id, paper.model_dump_json())
+            )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, user_id, query, status, sub_queries, papers_found, error,"
+                " (SELECT COUNT(*) FROM job_papers WHERE job_papers.job_id = jobs.job_id)"
+                " FROM jobs WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("job_id", "user_id", "query", "status", "sub_queries", "papers_found", "error", "papers_done")
+        record = dict(zip(keys, row))
+        record["sub_queries"] = json.loads(record["sub_queries"])
+        return record
+
+    def papers(self, job_id: str, since: int = 0) -> List[Paper]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT paper FROM job_papers WHERE job_id = ? AND position >= ? ORDER BY position",
+                (job_id, max(0, since))
+            ).fetchall()
+        return [Paper.model_validate_json(row[0]) for row in rows]
+
+    def purge(self, older_than: float):
+        """Drop finished jobs last updated before older_than"""
+        with self._lock, self._conn:
+            stale = f"SELECT job_id FROM jobs WHERE updated_at < ? AND status NOT IN ({', '.join('?' * len(JOB_ACTIVE_STATES))})"
+            params = (older_than, *JOB_ACTIVE_STATES)
+            self._conn.execute(f"DELETE FROM job_papers WHERE job_id IN ({stale})", params)
+            self._conn.execute(f"DELETE FROM jobs WHERE job_id IN ({stale})", params)
+
+def _open_job_store() -> JobStore:
+    if JOB_STORE_PATH:
+        try:
+            return JobStore(JOB_STORE_PATH)
+        except sqlite3.Error as e:
+            logger.warning(f"Job store unavailable ({JOB_STORE_PATH}), keeping jobs in memory: {e}")
+    return JobStore(":memory:")
+
+job_store = _open_job_store()
+
+async def plan_sub_queries(query: str, count: int) -> List[str]:
+    """
+    The query plus up to count - 1 narrower sub-queries from sonar; just the
+    query if planning fails
+    """
+    sub_queries: List[str] = []
+    if count > 1:
+        prompt = f"""
+        Split this literature search into {count - 1} narrower search queries that together
+        cover the topic: distinct sub-topics, methods and application areas.
+
+        Topic: {query}
+
+        Return ONLY a JSON list of strings, no other text.
+        """
+        try:
+            response = await chat_completion(
+                stage="job_plan",
+                model="sonar",
+                query=query,
+                messages=[
+                    {"role": "system", "content": "You plan academic literature searches. Respond with ONLY a JSON list of search query strings."},
+                    {"role": "user", "content": prompt}
+                ]
+            )
+            parsed = summary_extractor.loads(response.choices[0].message.content or '', '[')
+            if isinstance(parsed, list):
+                sub_queries = [item.strip() for item in parsed if isinstance(item, str) and item.strip()]
+        except Exception as e:
+            logger.warning(f"Could not plan sub-queries for {query!r}: {e}")
+    return list(dict.fromkeys([query] + sub_queries))[:max(1, count)]
+
+class DeepSearchJob:
+    """
+    One running deep search. Sub-queries are taken from a shared queue by
+    JOB_WORKERS workers; each worker searches its sub-query and summarizes
+    the papers no other sub-query has found yet, against the main query.
+    """
+
+    def __init__(self, job_id: str, user_id: str, query: str, sub_queries: List[str], max_papers: int,
+                 exclude_urls: Optional[List[str]] = None):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.query = query
+        self.sub_queries = sub_queries
+        self.max_papers = max_papers
+        self.task: Optional[asyncio.Task] = None
+        # Papers the caller already has are skipped like duplicates
+        self._seen: set = {canonical_paper_id(url) for url in exclude_urls or []}
+        self._found = 0
+        self._changed = asyncio.Event()
+
+    def changed(self) -> asyncio.Event:
+        """Event set on the next new paper or status change"""
+        return self._changed
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def run(self):
+        heartbeat = asyncio.ensure_future(self._heartbeat())
+        try:
+            if not self.sub_queries:
+                await asyncio.to_thread(job_store.update, self.job_id, status="planning")
+                self._notify()
+                self.sub_queries = await plan_sub_queries(self.query, JOB_SUB_QUERIES)
+            await asyncio.to_thread(job_store.update, self.job_id, status="running", sub_queries=self.sub_queries)
+            self._notify()
+
+            queue: asyncio.Queue = asyncio.Queue()
+            for sub_query in self.sub_queries:
+                queue.put_nowait(sub_query)
+            workers = [asyncio.ensure_future(self._worker(queue)) for _ in range(max(1, min(JOB_WORKERS, len(self.sub_queries))))]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for worker in workers:
+                    worker.cancel()
+            await self._finish("done")
+        except asyncio.CancelledError:
+            await self._finish("cancelled")
+            raise
+        except Exception as e:
+            logger.exception(f"Deep search job {self.job_id} failed: {e}")
+            await self._finish("failed", str(e))
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self):
+        """Keep the record fresh, and honour cancellation requested through another worker"""
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT)
+            try:
+                cancel = await asyncio.to_thread(job_store.touch, self.job_id)
+            except sqlite3.Error as e:
+                logger.warning(f"Job {self.job_id} heartbeat failed: {e}")
+                continue
+            if cancel and self.task is not None:
+                self.task.cancel()
+                return
+
+    async def _worker(self, queue: asyncio.Queue):
+        while self._found < self.max_papers:
+            try:
+                sub_query = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            fresh = []
+            for raw_paper in await fetch_papers(sub_query):
+                paper_id = canonical_paper_id(raw_paper.get('url', ''))
+                if raw_paper.get('fallback') or paper_id in self._seen or self._found >= self.max_papers:
+                    continue
+                self._seen.add(paper_id)
+                self._found += 1
+                fresh.append(raw_paper)
+            await asyncio.to_thread(job_store.update, self.job_id, papers_found=self._found)
+            async for index, summary in iter_summaries(fresh, self.query):
+                await asyncio.to_thread(job_store.add_paper, self.job_id, build_paper(fresh[index], summary))
+                self._notify()
+
+    async def _finish(self, status: str, error: Optional[str] = None):
+        try:
+            await asyncio.to_thread(job_store.update, self.job_id, status=status, error=error)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not record end of job {self.job_id}: {e}")
+        finally:
+            # Even if cancelled again while the write runs
+            active_jobs.pop(self.job_id, None)
+            self._notify()
+
+# Jobs currently running in this process
+active_jobs: dict = {}
+
+async def start_job(user_id: str, client: str, query: str, sub_queries: Optional[List[str]], max_papers: int,
+                    exclude_urls: Optional[List[str]] = None) -> DeepSearchJob:
+    """Record and launch a job at background priority; `client` is who its limits apply to"""
+    sub_queries = list(dict.fromkeys(q.strip() for q in (sub_queries or []) if q.strip()))
+    job = DeepSearchJob(uuid.uuid4().hex, user_id, query, sub_queries, max(1, min(max_papers, JOB_MAX_PAPERS)),
+                        (exclude_urls or [])[:JOB_MAX_EXCLUDED])
+
+    def record():
+        job_store.purge(time.time() - JOB_RETENTION)
+        job_store.mark_stale()
+        job_store.create(job.job_id, user_id, query, sub_queries, client)
+
+    await asyncio.to_thread(record)
+    active_jobs[job.job_id] = job
+    # Deep searches must never slow down interactive /search traffic. A job
+    # is charged to its user's budget only: the per-request limit would cut
+    # it off after a few papers
+    with background_priority(), usage_scope(UsageScope(user_id, "/jobs", limit=0, limit_key=client)):
+        job.task = asyncio.ensure_future(job.run())
+    return job
+
+# =====================
+# Startup warm-up
+# =====================
+
+# File of popular queries (one per line, "#" comments) searched and
+# summarized in the background on startup, so their first real request is a
+# cache hit. With a shared cache only one worker does this.
+WARMUP_QUERIES_FILE = os.getenv("SCHOLARSWIPE_WARMUP_QUERIES_FILE", "")
+WARMUP_CONCURRENCY = int(os.getenv("SCHOLARSWIPE_WARMUP_CONCURRENCY", "2"))
+WARMUP_LEASE = float(os.getenv("SCHOLARSWIPE_WARMUP_LEASE", "600"))
+
+def load_warmup_queries(path: str) -> List[str]:
+    """Queries from the warm-up file, without blanks, comments or normalized duplicates"""
+    queries: dict = {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                query = line.strip()
+                if query and not query.startswith('#'):
+                    queries.setdefault(normalize_query(query), query)
+    except OSError as e:
+        logger.warning(f"Could not read warm-up queries from {path}: {e}")
+    return list(queries.values())
+
+async def warm_up(queries: List[str]):
+    """Search and summarize each query, WARMUP_CONCURRENCY at a time, at background priority"""
+    if shared_limits is not None:
+        try:
+            claimed = await asyncio.to_thread(shared_limits.claim, "warmup", WARMUP_LEASE)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not claim the warm-up lease, skipping warm-up: {e}")
+            return
+        if not claimed:
+            logger.info("Warm-up already done by another worker")
+            return
+    semaphore = asyncio.Semaphore(max(1, WARMUP_CONCURRENCY))
+    start = time.perf_counter()
+
+    async def warm(query: str):
+        async with semaphore:
+            with metrics.timer("warmup"):
+                await summarize_papers(await fetch_papers(query), query)
+
+    results = await asyncio.gather(*(warm(query) for query in queries), return_exceptions=True)
+    failed = sum(1 for result in results if isinstance(result, Exception))
+    logger.info(f"Warm-up of {len(queries)} queries finished in {time.perf_counter() - start:.1f}s ({failed} failed)")
 
 # =====================
 # API Endpoints
 # =====================
 
+@app.exception_handler(BudgetExceeded)
+async def budget_exceeded_handler(request: Request, exc: BudgetExceeded):
+    """A spent budget is a 429, with Retry-After when the user's window will free some up"""
+    headers = {"Retry-After": str(int(math.ceil(exc.retry_after)))} if exc.retry_after else None
+    return JSONResponse(status_code=429, content={"detail": str(exc)}, headers=headers)
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -402,144 +3500,341 @@ async def root():
         "version": "1.0.0"
     }
 
+def upstream_unavailable(error: Exception) -> HTTPException:
+    """503 for an open circuit, or for an upstream still failing after retries"""
+    retry_after = error.retry_after if isinstance(error, UpstreamUnavailable) else UPSTREAM_BACKOFF_MAX
+    return HTTPException(status_code=503, detail=str(error) or "Upstream unavailable",
+                         headers={"Retry-After": str(int(math.ceil(retry_after)))})
+
+async def fetch_papers_or_503(query: str) -> List[dict]:
+    """fetch_papers() for the search endpoints: an unavailable upstream is a 503, not a 404"""
+    try:
+        return await fetch_papers(query)
+    except (UpstreamUnavailable,) + TRANSIENT_ERRORS as e:
+        raise upstream_unavailable(e)
+
 @app.post("/search", response_model=SearchResponse)
 async def search(request: SearchRequest):
     if not request.query or len(request.query.strip()) == 0:
         raise HTTPException(status_code=400, detail="Query cannot be empty")
     
     try:
-        raw_papers = search_papers(request.query)
+        raw_papers = await fetch_papers_or_503(request.query)
         if not raw_papers:
             raise HTTPException(status_code=404, detail="No papers found for this query")
         
-        papers_with_summaries = []
-        for raw_paper in raw_papers:
-            summary = generate_summary(raw_paper, request.query)
-            paper = Paper(
-                title=summary.title,  # Use title from summary which may be improved
-                url=raw_paper.get('url', ''),
-                snippet=raw_paper.get('snippet'),
-                abstract=raw_paper.get('snippet'),
-                summary=summary
-            )
-            papers_with_summaries.append(paper)
+        summaries = await summarize_papers(raw_papers, request.query)
+        papers_with_summaries = [
+            build_paper(raw_paper, summary)
+            for raw_paper, summary in zip(raw_papers, summaries)
+        ]
         
         return SearchResponse(
             query=request.query,
             papers=papers_with_summaries,
             total_results=len(papers_with_summaries)
         )
-    except HTTPException:
+    except (HTTPException, BudgetExceeded):
         raise
     except Exception as e:
-        print(f"Error in search endpoint: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error in search endpoint: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.post("/search/stream")
+async def search_stream(request: SearchRequest):
+    """
+    Streaming variant of /search (NDJSON, one event per line):
+      {"type": "papers", ...}  raw paper list from search_papers(), sent first
+      {"type": "paper", "index": i, "paper": {...}}  each card once summarized
+      {"type": "done", "total_results": n}
+    Cards arrive in completion order; "index" is the position in the list.
+    """
+    if not request.query or len(request.query.strip()) == 0:
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+
+    raw_papers = await fetch_papers_or_503(request.query)
+    if not raw_papers:
+        raise HTTPException(status_code=404, detail="No papers found for this query")
+
+    async def events():
+        yield ndjson_line({
+            "type": "papers",
+            "query": request.query,
+            "papers": [
+                {"title": p.get('title', ''), "url": p.get('url', ''), "snippet": p.get('snippet')}
+                for p in raw_papers
+            ],
+            "total_results": len(raw_papers)
+        })
+        try:
+            async for index, summary in iter_summaries(raw_papers, request.query):
+                paper = build_paper(raw_papers[index], summary)
+                yield ndjson_line({"type": "paper", "index": index, "paper": paper.model_dump()})
+        except Exception as e:
+            logger.exception(f"Error in search stream: {e}")
+            yield ndjson_line({"type": "error", "detail": str(e)})
+            return
+        yield ndjson_line({"type": "done", "total_results": len(raw_papers)})
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+def ndjson_line(event: dict) -> str:
+    """Serialize one streaming event as a newline-delimited JSON record"""
+    return json.dumps(event) + "\n"
+
+@app.post("/search/session", response_model=SessionResponse)
+async def create_search_session(request: SearchRequest):
+    """
+    Paged alternative to /search: returns the paper list right away, without
+    summaries, plus a session id for fetching summaries card by card.
+    """
+    if not request.query or len(request.query.strip()) == 0:
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+
+    raw_papers = await fetch_papers_or_503(request.query)
+    if not raw_papers:
+        raise HTTPException(status_code=404, detail="No papers found for this query")
+
+    session = SearchSession(uuid.uuid4().hex, request.query, raw_papers)
+    await save_session(session)
+    # Warm up the first cards the user is about to see
+    session.summary_task(0)
+    session.prefetch(0, PREFETCH_AHEAD)
+
+    return SessionResponse(
+        session_id=session.session_id,
+        query=request.query,
+        papers=[
+            Paper(title=p.get('title', ''), url=p.get('url', ''), snippet=p.get('snippet'), abstract=p.get('snippet'))
+            for p in raw_papers
+        ],
+        total_results=len(raw_papers)
+    )
+
+@app.get("/search/session/{session_id}/paper/{index}", response_model=Paper)
+async def get_session_paper(session_id: str, index: int, prefetch: int = PREFETCH_AHEAD):
+    """Summarized card at index; the next `prefetch` cards are started in the background"""
+    session = await get_session(session_id)
+    if index < 0 or index >= len(session.raw_papers):
+        raise HTTPException(status_code=404, detail="Paper index out of range")
+
+    task = session.summary_task(index)
+    # Cards the user has not reached yet wait behind interactive upstream calls
+    with background_priority():
+        session.prefetch(index, max(0, prefetch))
+    summary = await asyncio.shield(task)
+    return build_paper(session.raw_papers[index], summary)
+
+@app.delete("/search/session/{session_id}")
+async def delete_search_session(session_id: str):
+    """Drop a session and cancel its pending summaries"""
+    session = await get_session(session_id)
+    session.cancel()
+    session_store.delete(session_id)
+    if shared_cache is not None:
+        await shared_cache_call(shared_cache, "delete", "session", session_id)
+    return {"deleted": session_id}
+
 @app.post("/generate_conclusion", response_model=ConclusionResponse)
 async def generate_conclusion(request: ConclusionRequest):
     if not request.papers or len(request.papers) == 0:
         raise HTTPException(status_code=400, detail="No papers provided")
     
     try:
-        papers_text = "\n\n".join([
-            f"Paper {i+1}: {paper.title}\n"
-            f"Summary: {paper.summary.summary if paper.summary else 'N/A'}\n"
-            f"Key Findings: {paper.summary.key_findings if paper.summary else 'N/A'}"
-            for i, paper in enumerate(request.papers)
-        ])
-        
-        prompt = f"""
-        Based on these {len(request.papers)} research papers, write a comprehensive summary
-        that synthesizes the research topic (2-3 paragraphs):
-        
-        1. Provide an overview of the research area and what these papers collectively explore
-        2. Identify common themes, methodologies, and key insights across the papers
-        3. Note the overall significance and future directions in this field
-        
-        Papers reviewed:
-        {papers_text}
-        
-        Write a cohesive academic summary that gives students a strong understanding of the 
-        overall research landscape on this topic. Keep it informative but accessible.
-        
-        IMPORTANT: 
-        - Do NOT include citations like [1], [2], etc.
-        - Do NOT use LaTeX formatting or special characters
-        - Do NOT use markdown formatting (**, ***, __, etc.)
-        - Write in plain text paragraphs only
-        - Make it readable and clear
-        - Use paragraphs if possible
-        """
-        
-        response = client.chat.completions.create(
-            model="sonar-pro",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert academic writer. Synthesize multiple research papers into a cohesive summary that helps students understand the research landscape."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-        )
-        
-        conclusion = response.choices[0].message.content
+        conclusion = await synthesize_conclusion(request.papers)
         return ConclusionResponse(
             conclusion=conclusion,
             total_papers=len(request.papers)
         )
+    except UpstreamUnavailable as e:
+        raise upstream_unavailable(e)
+    except BudgetExceeded:
+        raise
     except Exception as e:
-        print(f"Error generating conclusion: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error generating conclusion: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to generate conclusion: {str(e)}")
 
 class BibliographyRequest(BaseModel):
     papers: List[Paper]
+    # harvard, apa, bibtex or ris
+    format: str = "harvard"
 
 class BibliographyResponse(BaseModel):
     bibliography: str
     format: str
     total_papers: int
 
+def bibliography_style(request: BibliographyRequest) -> str:
+    """Validated, lowercased style name of a bibliography request"""
+    if not request.papers:
+        raise HTTPException(status_code=400, detail="No papers provided")
+    style = request.format.strip().lower()
+    if style not in BIBLIOGRAPHY_STYLES:
+        raise HTTPException(status_code=400, detail=f"Unknown format; use one of: {', '.join(BIBLIOGRAPHY_STYLES)}")
+    return style
+
 @app.post("/generate_bibliography", response_model=BibliographyResponse)
 async def generate_bibliography(request: BibliographyRequest):
-    """Generate bibliography in Harvard format"""
-    if not request.papers or len(request.papers) == 0:
-        raise HTTPException(status_code=400, detail="No papers provided")
-    
+    """Generate bibliography in Harvard, APA, BibTeX or RIS format"""
+    style = bibliography_style(request)
+
     try:
-        bibliography_lines = []
-        
-        for i, paper in enumerate(request.papers, 1):
-            title = paper.title or "Unknown Paper"
-            url = paper.url or ""
-            
-            # Harvard format: Author/Title (Year) Title. Available at: URL (Accessed: Date)
-            # Since we don't have author info, we'll use title-based Harvard format
-            from datetime import datetime
-            current_date = datetime.now().strftime("%d %B %Y")
-            
-            citation = f"{title}. Available at: {url} (Accessed: {current_date})."
-            bibliography_lines.append(f"{i}. {citation}")
-        
-        bibliography = "\n\n".join(bibliography_lines)
-        
         return BibliographyResponse(
-            bibliography=bibliography,
-            format="Harvard",
+            bibliography="".join(iter_bibliography(request.papers, style)),
+            format=BIBLIOGRAPHY_STYLES[style][0],
             total_papers=len(request.papers)
         )
     except Exception as e:
-        print(f"Error generating bibliography: {e}")
+        logger.exception(f"Error generating bibliography: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to generate bibliography: {str(e)}")
 
+@app.post("/generate_bibliography/stream")
+async def generate_bibliography_stream(request: BibliographyRequest):
+    """
+    Same bibliography as a chunked file download, so large exports are never
+    built in memory as one string
+    """
+    style = bibliography_style(request)
+    _, media_type, extension = BIBLIOGRAPHY_STYLES[style]
+    return StreamingResponse(
+        stream_bibliography(request.papers, style),
+        media_type=f"{media_type}; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="scholarswipe-bibliography.{extension}"'}
+    )
+
+class JobRequest(BaseModel):
+    query: str
+    # Searched as given; planned by sonar when omitted
+    sub_queries: Optional[List[str]] = None
+    max_papers: int = 50
+    # Papers the caller already has (e.g. its current deck): skipped, and
+    # not counted towards max_papers
+    exclude_urls: Optional[List[str]] = None
+
+class JobResponse(BaseModel):
+    job_id: str
+    query: str
+    status: str
+    sub_queries: List[str]
+    papers_found: int
+    papers_done: int
+    papers: List[Paper] = []
+    error: Optional[str] = None
+
+def read_job(job_id: str) -> Optional[dict]:
+    """job_store.get(), after expiring jobs whose worker died (they would otherwise show as running forever)"""
+    job_store.mark_stale()
+    return job_store.get(job_id)
+
+async def get_job_record(job_id: str, request: Request) -> dict:
+    """The caller's own job, or 404"""
+    record = await asyncio.to_thread(read_job, job_id)
+    if record is None or record["user_id"] != client_id(request):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return record
+
+@app.post("/jobs", response_model=JobResponse, status_code=202)
+async def create_job(body: JobRequest, request: Request):
+    """
+    Start a deep search in the background. Poll GET /jobs/{job_id} or read
+    GET /jobs/{job_id}/stream for results.
+    """
+    if not body.query or len(body.query.strip()) == 0:
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+    user_id, client = client_id(request), client_limit_key(request)
+    # Counted in the job store, so the cap holds across worker processes;
+    # jobs of a worker that died no longer count
+    def running() -> int:
+        job_store.mark_stale()
+        return job_store.active_count(client)
+
+    if await asyncio.to_thread(running) >= JOB_MAX_PER_USER:
+        raise HTTPException(status_code=429, detail=f"At most {JOB_MAX_PER_USER} deep searches can run at once")
+    await UsageScope(user_id, "/jobs", limit=0, limit_key=client).check()
+
+    job = await start_job(user_id, client, body.query.strip(), body.sub_queries, body.max_papers, body.exclude_urls)
+    return JobResponse(**{**await asyncio.to_thread(job_store.get, job.job_id), "papers": []})
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str, request: Request, since: int = 0):
+    """Job status plus the papers finished after the first `since` (pass the count already received)"""
+    record = await get_job_record(job_id, request)
+    return JobResponse(**record, papers=await asyncio.to_thread(job_store.papers, job_id, since))
+
+@app.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: str, request: Request, since: int = 0):
+    """
+    Job progress as NDJSON, like /search/stream:
+      {"type": "status", ...}  the job record, sent first
+      {"type": "paper", "index": i, "paper": {...}}  each finished card, from `since` on
+      {"type": "done", "status": ..., "error": ...}  once the job has ended
+    """
+    record = await get_job_record(job_id, request)
+
+    async def events():
+        sent = max(0, since)
+        yield ndjson_line({"type": "status", **record})
+        while True:
+            job = active_jobs.get(job_id)
+            # Take the event before reading so no change can slip in between
+            changed = job.changed() if job else None
+            for paper in await asyncio.to_thread(job_store.papers, job_id, sent):
+                yield ndjson_line({"type": "paper", "index": sent, "paper": paper.model_dump()})
+                sent += 1
+            current = await asyncio.to_thread(job_store.get, job_id)
+            if current is None or current["status"] not in JOB_ACTIVE_STATES:
+                yield ndjson_line({"type": "done", "status": current["status"] if current else "deleted",
+                                   "error": current["error"] if current else None, "total_results": sent})
+                return
+            if changed is not None:
+                await changed.wait()
+            else:
+                # Running in another worker process: poll the job store,
+                # which ends the stream if that worker has died
+                await asyncio.sleep(1.0)
+                await asyncio.to_thread(job_store.mark_stale)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str, request: Request):
+    """Cancel a running job; papers finished so far stay available"""
+    record = await get_job_record(job_id, request)
+    if record["status"] not in JOB_ACTIVE_STATES:
+        raise HTTPException(status_code=409, detail=f"Job already {record['status']}")
+    job = active_jobs.get(job_id)
+    if job is not None:
+        job.task.cancel()
+    else:
+        await asyncio.to_thread(job_store.request_cancel, job_id)
+    return {"cancelled": job_id}
+
 # Run with: uvicorn ScholarSwipe:app --reload command
+# or: python ScholarSwipe_Backend.py --workers 4 --warmup popular_queries.txt
 if __name__ == "__main__":
+    import argparse
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    arg_parser = argparse.ArgumentParser(description="Run the ScholarSwipe API")
+    arg_parser.add_argument("--host", default=os.getenv("SCHOLARSWIPE_HOST", "0.0.0.0"))
+    arg_parser.add_argument("--port", type=int, default=int(os.getenv("SCHOLARSWIPE_PORT", "8000")))
+    arg_parser.add_argument("--workers", type=int, default=int(os.getenv("SCHOLARSWIPE_WORKERS", "1")),
+                            help="Worker processes; more than one shares state through SQLite")
+    arg_parser.add_argument("--warmup", help="File of queries (one per line) to pre-search on startup")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    # Worker processes import this module afresh, so settings go through the environment
+    if args.warmup:
+        os.environ["SCHOLARSWIPE_WARMUP_QUERIES_FILE"] = args.warmup
+        WARMUP_QUERIES_FILE = args.warmup
+
+    if args.workers > 1:
+        # Workers must share the cache, sessions and rate limits
+        if not CACHE_SQLITE_PATH:
+            os.environ["SCHOLARSWIPE_CACHE_SQLITE_PATH"] = "scholarswipe.db"
+        module = os.path.splitext(os.path.basename(__file__))[0]
+        uvicorn.run(f"{module}:app", host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,527 @@
+"""
+ScholarSwipe Benchmarks
+Offline micro-benchmarks for the backend; no Perplexity API calls are made.
+
+Run with:
+    python ScholarSwipe_Benchmark.py parser
+    python ScholarSwipe_Benchmark.py json --fuzz 20000
+    python ScholarSwipe_Benchmark.py load --concurrency 1 8 32 --output results.json
+"""
+#import libraries
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import time
+from types import SimpleNamespace
+from typing import List, Optional
+
+import httpx
+from perplexity import APITimeoutError
+
+# The backend opens its SQLite stores on import; keep them in memory so a
+# benchmark run leaves no scholarswipe.db behind and never reads a real one
+for _store in ("TITLE_INDEX", "PAPER_STORE", "USAGE_STORE", "JOB_STORE"):
+    os.environ[f"SCHOLARSWIPE_{_store}_PATH"] = ":memory:"
+os.environ["SCHOLARSWIPE_CACHE_SQLITE_PATH"] = ""
+
+import ScholarSwipe_Backend as backend
+from ScholarSwipe_Backend import SonarResponseParser, SummaryExtractor, clean_title, extract_title_from_url
+
+# =====================
+# Sonar response parser
+# =====================
+
+WORDS = (
+    "learning neural graph network attention transformer protein climate "
+    "quantum model analysis survey robust efficient causal inference data"
+).split()
+
+def synthetic_sonar_response(entries: int, seed: int = 0) -> str:
+    """A Sonar-style reply with `entries` Title/URL/Description blocks, every tenth as a markdown link"""
+    rng = random.Random(seed)
+    blocks = []
+    for i in range(entries):
+        title = ' '.join(rng.choice(WORDS) for _ in range(8)).title()
+        description = ' '.join(rng.choice(WORDS) for _ in range(40))
+        url = f"https://arxiv.org/abs/{2300 + i // 10000}.{i % 100000:05d}"
+        blocks.append(
+            f"{i + 1}. **Title:** {title}\n"
+            f"   **URL:** {f'[{title}]({url})' if i % 10 == 9 else url}\n"
+            f"   **Description:** {description}."
+        )
+    return "Here are relevant papers:\n\n" + "\n\n".join(blocks)
+
+# Reply shapes the parser has got wrong before: (reply, expected url, expected snippet)
+PARSER_FIXTURES = [
+    ("Title: Attention Is All You Need\nURL: [Attention Is All You Need](https://arxiv.org/abs/1706.03762)\n"
+     "Description: Introduces the Transformer.",
+     "https://arxiv.org/abs/1706.03762", "Introduces the Transformer."),
+    ("Title: Attention\nURL: [https://arxiv.org/abs/1706.03762](https://arxiv.org/abs/1706.03762).\n"
+     "Description: Markdown link whose text is the URL.",
+     "https://arxiv.org/abs/1706.03762", "Markdown link whose text is the URL."),
+    ("Title: Foo\nURL: https://en.wikipedia.org/wiki/Foo_(bar).\nDescription: Balanced parentheses.",
+     "https://en.wikipedia.org/wiki/Foo_(bar)", "Balanced parentheses."),
+    ("Title: Foo\nURL: [Foo](https://en.wikipedia.org/wiki/Foo_(bar))\nDescription: Parentheses in a link.",
+     "https://en.wikipedia.org/wiki/Foo_(bar)", "Parentheses in a link."),
+    ("See the survey (https://doi.org/10.1000/xyz123).\nTitle: Survey URL: https://doi.org/10.1000/xyz123",
+     "https://doi.org/10.1000/xyz123", ""),
+    ("1. **Title:** Graph Networks **URL:** https://www.nature.com/articles/s41586 "
+     "**Description:** A one-line entry.",
+     "https://www.nature.com/articles/s41586", "A one-line entry."),
+]
+
+def check_parser_fixtures(parser: SonarResponseParser):
+    for reply, url, snippet in PARSER_FIXTURES:
+        parsed = parser.parse(reply)
+        got = [(p['url'], p['snippet']) for p in parsed]
+        assert (url, snippet) in got, (reply, got)
+
+def legacy_parse(response_text: str) -> List[dict]:
+    """The pre-parser algorithm: one description regex rescan and one list scan per URL"""
+    papers: List[dict] = []
+    titles = re.findall(r'Title:\s*(.+?)(?:\n|URL:|$)', response_text, re.IGNORECASE | re.MULTILINE)
+    urls = re.findall(r'URL:\s*(https?://[^\s\n]+)', response_text, re.IGNORECASE | re.MULTILINE)
+    for i, url in enumerate(urls):
+        title = clean_title(titles[i] if i < len(titles) else extract_title_from_url(url))
+        existing = next((p for p in papers if p['url'] == url), None)
+        if existing:
+            continue
+        snippet = ""
+        desc_match = re.search(
+            rf'{re.escape(url)}.*?Description:\s*(.+?)(?:\n\n|Title:|$)',
+            response_text, re.DOTALL | re.IGNORECASE
+        )
+        if desc_match:
+            snippet = desc_match.group(1).strip()[:200]
+        papers.append({"title": title, "url": url, "snippet": snippet})
+    return papers
+
+def time_call(fn, repeat: int) -> float:
+    """Best-of-`repeat` wall time of fn() in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_parser(sizes: List[int], repeat: int, legacy_max: int):
+    """Parse time per record should stay flat as the reply grows"""
+    parser = SonarResponseParser(max_papers=None)
+    check_parser_fixtures(parser)
+    print(f"{'entries':>8} {'chars':>10} {'parser ms':>10} {'us/entry':>9} {'legacy ms':>10}")
+    for entries in sizes:
+        text = synthetic_sonar_response(entries)
+        parsed = parser.parse(text)
+        assert len(parsed) == entries, (len(parsed), entries)
+        elapsed = time_call(lambda: parser.parse(text), repeat)
+        legacy = f"{time_call(lambda: legacy_parse(text), 1) * 1000:10.1f}" if entries <= legacy_max else f"{'-':>10}"
+        print(f"{entries:>8} {len(text):>10} {elapsed * 1000:>10.2f} {elapsed / entries * 1e6:>9.2f} {legacy}")
+
+# =====================
+# Summary JSON extraction
+# =====================
+
+def summary_json(rng: random.Random) -> dict:
+    return {
+        "title": ' '.join(rng.choice(WORDS) for _ in range(8)).title(),
+        "key_findings": "Finds a consistent improvement over prior baselines {p < 0.05}.",
+        "methodology": "Controlled experiments on public benchmarks, with ablations.",
+        "limitations": "Evaluated on a limited set of domains.",
+        "summary": "Proposes a method and evaluates it. Results are \"promising\".",
+        "relevance_score": rng.randint(50, 100),
+        "authenticity_score": rng.randint(60, 100)
+    }
+
+# How sonar-pro replies deviate from "ONLY valid JSON"; each takes the
+# serialized object and returns the reply text
+REPLY_STYLES = {
+    "clean": lambda body, rng: body,
+    "fenced": lambda body, rng: f"```json\n{body}\n```",
+    "prose": lambda body, rng: f"Here is the summary you asked for:\n\n{body}\n\nLet me know if you need more detail.",
+    "prose_braces": lambda body, rng: f"Summary of the paper {{see below}}:\n{body}",
+    "trailing_comma": lambda body, rng: body[:-1] + ",\n}",
+    "smart_quotes": lambda body, rng: re.sub(r'"([^"\\]*)"', lambda m: f"“{m.group(1)}”", body),
+    "string_scores": lambda body, rng: re.sub(r'("(?:relevance|authenticity)_score": )(\d+)', r'\1"\2%"', body),
+    "out_of_range": lambda body, rng: re.sub(r'("relevance_score": )\d+', r'\g<1>140', body),
+    "truncated": lambda body, rng: body[:rng.randint(len(body) // 2, len(body) - 2)],
+}
+
+def summary_reply_corpus(count: int, seed: int = 0) -> List[tuple]:
+    """(style, reply) pairs cycling through REPLY_STYLES"""
+    rng = random.Random(seed)
+    styles = list(REPLY_STYLES)
+    corpus = []
+    for i in range(count):
+        style = styles[i % len(styles)]
+        body = json.dumps(summary_json(rng), indent=2, ensure_ascii=False)
+        corpus.append((style, REPLY_STYLES[style](body, rng)))
+    return corpus
+
+def legacy_summary_parse(response_text: str) -> Optional[dict]:
+    """The pre-extractor algorithm: strip a leading code fence and json.loads the rest"""
+    response_text = response_text.strip()
+    if response_text.startswith("```"):
+        response_text = response_text.strip("`").replace("json\n", "").strip()
+    try:
+        return json.loads(response_text)
+    except ValueError:
+        return None
+
+def legacy_summary_ok(response_text: str) -> bool:
+    """Whether the old code would have produced a PaperSummary (rather than the default one)"""
+    data = legacy_summary_parse(response_text)
+    try:
+        backend.PaperSummary(**data)
+        return True
+    except Exception:
+        return False
+
+def bench_json(count: int, repeat: int, seed: int):
+    """Per reply style: how often each parser yields a usable summary, and at what cost"""
+    extractor = SummaryExtractor()
+    corpus = summary_reply_corpus(count, seed)
+    print(f"{'style':<15} {'legacy ok':>10} {'complete':>9} {'partial':>8} {'lost':>6}")
+    for style in REPLY_STYLES:
+        replies = [reply for s, reply in corpus if s == style]
+        legacy_ok = sum(1 for reply in replies if legacy_summary_ok(reply))
+        outcomes = [extractor.parse_summary(reply)[1] for reply in replies]
+        complete = sum(1 for missing in outcomes if not missing)
+        lost = sum(1 for missing in outcomes if len(missing) == len(backend.SUMMARY_FIELDS))
+        print(f"{style:<15} {legacy_ok:>10} {complete:>9} {len(replies) - complete - lost:>8} {lost:>6}")
+
+    replies = [reply for _, reply in corpus]
+    extractor_time = time_call(lambda: [extractor.parse_summary(reply) for reply in replies], repeat)
+    legacy_time = time_call(lambda: [legacy_summary_parse(reply) for reply in replies], repeat)
+    print(f"\n{len(replies)} replies: extractor {extractor_time / len(replies) * 1e6:.1f} us/reply, "
+          f"legacy {legacy_time / len(replies) * 1e6:.1f} us/reply")
+
+FUZZ_CHARS = '{}[]",:\\ \n“”abc019.-'
+
+def mutate(text: str, rng: random.Random) -> str:
+    """Delete, insert or duplicate a few random spans, or cut the text short"""
+    for _ in range(rng.randint(1, 4)):
+        op = rng.randrange(4)
+        i = rng.randrange(len(text) + 1)
+        if op == 0:
+            text = text[:i] + text[i + rng.randint(1, 8):]
+        elif op == 1:
+            text = text[:i] + ''.join(rng.choice(FUZZ_CHARS) for _ in range(rng.randint(1, 4))) + text[i:]
+        elif op == 2:
+            j = min(len(text), i + rng.randint(1, 20))
+            text = text[:j] + text[i:j] + text[j:]
+        else:
+            text = text[:i]
+    return text
+
+def fuzz_json(iterations: int, seed: int):
+    """
+    Mutated replies must never raise, every field returned must be valid for
+    PaperSummary (scores clamped to 0-100), and untouched replies must parse
+    completely
+    """
+    extractor = SummaryExtractor()
+    rng = random.Random(seed)
+    corpus = [reply for style, reply in summary_reply_corpus(200, seed) if style != "truncated"]
+    complete = lost = 0
+    for _ in range(iterations):
+        reply = mutate(rng.choice(corpus), rng)
+        fields, missing = extractor.parse_summary(reply, "Fallback Title For Fuzzing")
+        assert set(fields) | set(missing) == set(backend.SUMMARY_FIELDS), reply
+        for field in backend.SUMMARY_SCORE_FIELDS:
+            assert field not in fields or 0 <= fields[field] <= 100, reply
+        if not missing:
+            backend.PaperSummary(**fields)
+            complete += 1
+        elif len(missing) == len(backend.SUMMARY_FIELDS) - 1:
+            lost += 1
+    for reply in corpus:
+        assert not extractor.parse_summary(reply)[1], reply
+    print(f"{iterations} mutated replies: {complete} complete, {iterations - complete - lost} partial, "
+          f"{lost} with nothing but the fallback title; no exceptions")
+
+# =====================
+# Local Perplexity stand-in
+# =====================
+
+class FakeSonar:
+    """
+    Stand-in for the Perplexity chat completions API. Replies look like the
+    real ones (Title/URL/Description search results, JSON summaries, plain
+    text conclusions) after a configurable latency with jitter, and a given
+    fraction of calls fail with a timeout error. Calls are counted per model.
+    """
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.2, error_rate: float = 0.0,
+                 papers: int = 10, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.papers = papers
+        self.rng = random.Random(seed)
+        self.calls: dict = {}
+
+    def delay(self) -> float:
+        return max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+
+    def reply(self, model: str, messages: List[dict]):
+        self.calls[model] = self.calls.get(model, 0) + 1
+        if self.rng.random() < self.error_rate:
+            raise APITimeoutError(request=httpx.Request("POST", "https://api.perplexity.ai/chat/completions"))
+
+        prompt = messages[-1]["content"]
+        if "Find recent academic research papers" in prompt:
+            text = synthetic_sonar_response(self.papers, seed=self.rng.randrange(1 << 30))
+        elif "JSON array" in prompt:
+            count = prompt.count("\nURL:")
+            text = json.dumps([dict(self.summary_fields(), index=i + 1) for i in range(count)])
+        elif "JSON" in prompt:
+            text = json.dumps(self.summary_fields())
+        elif model == "sonar":
+            text = ' '.join(self.rng.choice(WORDS) for _ in range(8)).title()
+        else:
+            text = "\n\n".join(' '.join(self.rng.choice(WORDS) for _ in range(60)) for _ in range(3))
+
+        words = len(text.split())
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=text))],
+            citations=None,
+            model=model,
+            usage=SimpleNamespace(prompt_tokens=len(prompt.split()), completion_tokens=words,
+                                  total_tokens=len(prompt.split()) + words)
+        )
+
+    def summary_fields(self) -> dict:
+        return {
+            "title": ' '.join(self.rng.choice(WORDS) for _ in range(8)).title(),
+            "key_findings": "Finds a consistent improvement over prior baselines.",
+            "methodology": "Controlled experiments on public benchmarks.",
+            "limitations": "Evaluated on a limited set of domains.",
+            "summary": "Proposes a method and evaluates it. Results are promising.",
+            "relevance_score": self.rng.randint(50, 100),
+            "authenticity_score": self.rng.randint(60, 100)
+        }
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+class _FakeCompletions:
+    def __init__(self, sonar: FakeSonar, is_async: bool):
+        self.sonar = sonar
+        self.is_async = is_async
+
+    def create(self, model: str, messages: List[dict], **kwargs):
+        if self.is_async:
+            return self._create_async(model, messages)
+        time.sleep(self.sonar.delay())
+        return self.sonar.reply(model, messages)
+
+    async def _create_async(self, model: str, messages: List[dict]):
+        await asyncio.sleep(self.sonar.delay())
+        return self.sonar.reply(model, messages)
+
+class FakePerplexityClient:
+    """Drop-in for Perplexity / AsyncPerplexity backed by a FakeSonar"""
+
+    def __init__(self, sonar: FakeSonar, is_async: bool = False):
+        self.chat = SimpleNamespace(completions=_FakeCompletions(sonar, is_async))
+
+    async def close(self):
+        pass
+
+def install_fake_sonar(sonar: FakeSonar):
+    """Swap the backend's Perplexity clients for the stand-in"""
+    backend.client = FakePerplexityClient(sonar)
+    backend.async_client = FakePerplexityClient(sonar, is_async=True)
+
+def reset_backend_state():
+    """Start each run cold so results are comparable"""
+    # Fake papers and titles must not land in (or be served from) any
+    # persistent store, even if the backend was imported before this module
+    backend.shared_cache = None
+    backend.shared_limits = None
+    for cache in (backend.search_cache, backend.summary_cache, backend.conclusion_group_cache):
+        cache.local.clear()
+        cache.shared = None
+    backend.bibliography_cache.clear()
+    backend.paper_store = None
+    backend.title_resolver.index = backend.TitleIndex(":memory:")
+    backend.job_store = backend.JobStore(":memory:")
+    # Fresh breakers, and no rate limit so the numbers measure the backend
+    # rather than the configured requests/sec
+    backend.upstream = backend.UpstreamScheduler({}, 0)
+    # Fake calls must not count towards real usage and budgets
+    backend.usage_ledger = backend.UsageLedger(":memory:", backend.usage_ledger.prices)
+
+# =====================
+# Endpoint load test
+# =====================
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+def sample_papers(count: int) -> List[dict]:
+    """Liked-paper payload for /generate_conclusion and /generate_bibliography"""
+    sonar = FakeSonar(papers=count, seed=count)
+    records = SonarResponseParser(max_papers=None).parse(synthetic_sonar_response(count))
+    return [
+        {"title": r["title"], "url": r["url"], "snippet": r["snippet"], "summary": sonar.summary_fields()}
+        for r in records
+    ]
+
+def endpoint_payload(endpoint: str, request_index: int, liked_papers: List[dict], repeat_queries: int) -> dict:
+    if endpoint == "/search":
+        # Distinct queries unless repeats are asked for, so caches don't hide upstream cost
+        query_id = request_index % repeat_queries if repeat_queries else request_index
+        return {"query": f"benchmark query {query_id}"}
+    return {"papers": liked_papers}
+
+async def run_level(http: httpx.AsyncClient, sonar: FakeSonar, endpoint: str, concurrency: int,
+                    requests: int, liked_papers: List[dict], repeat_queries: int) -> dict:
+    """Send `requests` calls to one endpoint with `concurrency` in flight"""
+    reset_backend_state()
+    calls_before = sonar.total_calls
+    latencies: List[float] = []
+    statuses: dict = {}
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < requests:
+            index = next_index
+            next_index += 1
+            payload = endpoint_payload(endpoint, index, liked_papers, repeat_queries)
+            start = time.perf_counter()
+            try:
+                response = await http.post(endpoint, json=payload)
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": requests,
+        "statuses": statuses,
+        "elapsed_s": round(elapsed, 4),
+        "requests_per_s": round(requests / elapsed, 3) if elapsed else 0.0,
+        "latency_s": {
+            "mean": round(statistics.fmean(latencies), 4) if latencies else 0.0,
+            "p50": round(percentile(latencies, 50), 4),
+            "p95": round(percentile(latencies, 95), 4),
+            "p99": round(percentile(latencies, 99), 4),
+            "max": round(max(latencies), 4) if latencies else 0.0,
+        },
+        "upstream_calls_per_request": round((sonar.total_calls - calls_before) / requests, 3) if requests else 0.0,
+    }
+
+@contextlib.contextmanager
+def quiet():
+    """Silence backend prints and tracebacks"""
+    sink = io.StringIO()
+    with contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+        yield
+
+async def bench_load(args) -> dict:
+    """Drive the FastAPI app in-process at each concurrency level"""
+    sonar = FakeSonar(args.latency, args.jitter, args.error_rate, args.papers, args.seed)
+    install_fake_sonar(sonar)
+    liked_papers = sample_papers(args.liked_papers)
+
+    results = []
+    transport = httpx.ASGITransport(app=backend.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        for endpoint in args.endpoints:
+            for concurrency in args.concurrency:
+                # The backend reports every injected upstream error; keep that out of the table
+                backend_output = contextlib.nullcontext() if args.verbose else quiet()
+                with backend_output:
+                    result = await run_level(http, sonar, endpoint, concurrency, args.requests,
+                                             liked_papers, args.repeat_queries)
+                results.append(result)
+                latency = result["latency_s"]
+                print(f"{endpoint:<24} c={concurrency:<4} {result['requests_per_s']:>8.2f} req/s  "
+                      f"p50={latency['p50']:.3f}s p95={latency['p95']:.3f}s p99={latency['p99']:.3f}s  "
+                      f"upstream/req={result['upstream_calls_per_request']}  {result['statuses']}")
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "config": {
+            "latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate,
+            "papers": args.papers, "liked_papers": args.liked_papers, "requests": args.requests,
+            "repeat_queries": args.repeat_queries, "seed": args.seed,
+            "summary_concurrency": backend.SUMMARY_CONCURRENCY,
+            "summary_batch_size": backend.SUMMARY_BATCH_SIZE,
+        },
+        "results": results,
+    }
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="ScholarSwipe offline benchmarks")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    parser_cmd = commands.add_parser("parser", help="Sonar response parser scaling")
+    parser_cmd.add_argument("--sizes", type=int, nargs="+", default=[250, 500, 1000, 2000, 4000, 8000])
+    parser_cmd.add_argument("--repeat", type=int, default=5)
+    parser_cmd.add_argument("--legacy-max", type=int, default=4000,
+                            help="Largest size also timed with the old quadratic parser")
+
+    json_cmd = commands.add_parser("json", help="Summary JSON extraction success rate, speed and fuzzing")
+    json_cmd.add_argument("--replies", type=int, default=900, help="Replies in the synthetic corpus")
+    json_cmd.add_argument("--repeat", type=int, default=5)
+    json_cmd.add_argument("--fuzz", type=int, default=0, help="Also run this many mutated replies")
+    json_cmd.add_argument("--seed", type=int, default=0)
+
+    load_cmd = commands.add_parser("load", help="Endpoint latency/throughput against a fake Sonar")
+    load_cmd.add_argument("--endpoints", nargs="+",
+                          default=["/search", "/generate_conclusion", "/generate_bibliography"])
+    load_cmd.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    load_cmd.add_argument("--requests", type=int, default=32, help="Requests per endpoint and level")
+    load_cmd.add_argument("--latency", type=float, default=0.5, help="Mean upstream latency (s)")
+    load_cmd.add_argument("--jitter", type=float, default=0.2, help="Uniform +/- latency jitter (s)")
+    load_cmd.add_argument("--error-rate", type=float, default=0.0, help="Fraction of upstream calls that fail")
+    load_cmd.add_argument("--papers", type=int, default=10, help="Papers per fake search reply")
+    load_cmd.add_argument("--liked-papers", type=int, default=20,
+                          help="Papers sent to /generate_conclusion and /generate_bibliography")
+    load_cmd.add_argument("--repeat-queries", type=int, default=0,
+                          help="Cycle through this many distinct /search queries (0 = all distinct)")
+    load_cmd.add_argument("--seed", type=int, default=0)
+    load_cmd.add_argument("--output", help="Write results as JSON to this file")
+    load_cmd.add_argument("--verbose", action="store_true", help="Show backend output during runs")
+
+    args = arg_parser.parse_args()
+    if args.command == "parser":
+        bench_parser(args.sizes, args.repeat, args.legacy_max)
+    elif args.command == "json":
+        bench_json(args.replies, args.repeat, args.seed)
+        if args.fuzz:
+            fuzz_json(args.fuzz, args.seed)
+    elif args.command == "load":
+        report = asyncio.run(bench_load(args))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
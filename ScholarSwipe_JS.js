@@ -2,12 +2,25 @@
 const API_BASE_URL = 'http://localhost:8000'; // Update this to your FastAPI backend URL
 // in general, the localhost will be 8000
 
+// Local store (IndexedDB): searches keyed by query, liked papers keyed by URL, and this browser's user id
+const DB_NAME = 'scholarswipe';
+const DB_VERSION = 2;
+const SEARCH_TTL_MS = 24 * 60 * 60 * 1000;      // a stored deck is dropped after a day
+const SEARCH_STALE_MS = 10 * 60 * 1000;         // ...and refreshed in the background after 10 minutes
+const LIKED_TTL_MS = 30 * 24 * 60 * 60 * 1000;  // liked papers are kept for 30 days
+
+// Prefetch: top up the deck with a deep search once this few cards are left
+const PREFETCH_BATCH = 10;
+const PREFETCH_POLL_MS = 2000;
+
 // State Management
 const state = {
     currentQuery: '',
     papers: [],
     currentIndex: 0,
     savedPapers: [],
+    searchId: 0,
+    prefetch: null,
 };
 
 // DOM Elements
@@ -18,6 +31,7 @@ const loadingOverlay = document.getElementById('loadingOverlay');
 
 const searchInput = document.getElementById('searchInput');
 const searchBtn = document.getElementById('searchBtn');
+const resumeBtn = document.getElementById('resumeBtn');
 const backBtn = document.getElementById('backBtn');
 const queryDisplay = document.getElementById('queryDisplay');
 const currentCardEl = document.getElementById('currentCard');
@@ -30,6 +44,7 @@ const resultsCount = document.getElementById('resultsCount');
 const savedPapersList = document.getElementById('savedPapersList');
 const exportCsvBtn = document.getElementById('exportCsvBtn');
 const createBibliographyBtn = document.getElementById('createBibliographyBtn');
+const bibliographyFormat = document.getElementById('bibliographyFormat');
 const generateSummaryBtn = document.getElementById('generateSummaryBtn');
 const summarySection = document.getElementById('summarySection');
 const summaryContent = document.getElementById('summaryContent');
@@ -56,9 +71,128 @@ function updateCounter() {
     totalCardsEl.textContent = state.papers.length;
 }
 
+// Local Store
+let dbPromise = null;
+
+// Resolves to null where IndexedDB is unavailable (e.g. private browsing); nothing is stored then
+function openDb() {
+    if (!dbPromise) {
+        dbPromise = new Promise(resolve => {
+            if (!window.indexedDB) return resolve(null);
+            const request = indexedDB.open(DB_NAME, DB_VERSION);
+            request.onupgradeneeded = () => {
+                const db = request.result;
+                if (!db.objectStoreNames.contains('searches')) db.createObjectStore('searches', { keyPath: 'key' });
+                if (!db.objectStoreNames.contains('liked')) db.createObjectStore('liked', { keyPath: 'url' });
+                if (!db.objectStoreNames.contains('meta')) db.createObjectStore('meta', { keyPath: 'key' });
+            };
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => {
+                console.error('Local store unavailable:', request.error);
+                resolve(null);
+            };
+        });
+    }
+    return dbPromise;
+}
+
+// Run requests against one object store; resolves with the last request's result, or null on failure
+async function dbRequest(storeName, mode, makeRequest) {
+    const db = await openDb();
+    if (!db) return null;
+    return new Promise(resolve => {
+        try {
+            const tx = db.transaction(storeName, mode);
+            const request = makeRequest(tx.objectStore(storeName));
+            tx.oncomplete = () => resolve(request?.result ?? null);
+            tx.onerror = tx.onabort = () => {
+                console.error('Local store error:', tx.error);
+                resolve(null);
+            };
+        } catch (error) {
+            console.error('Local store error:', error);
+            resolve(null);
+        }
+    });
+}
+
+// Same query, different spelling: "Deep Learning?" and "deep learning" share a stored deck
+function queryKey(query) {
+    return query.toLowerCase().replace(/[^\w\s]/g, ' ').replace(/\s+/g, ' ').trim();
+}
+
+// The stored deck for a query, or null if there is none or it has expired
+async function getStoredSearch(query) {
+    const record = await dbRequest('searches', 'readonly', store => store.get(queryKey(query)));
+    if (!record) return null;
+    if (Date.now() - record.savedAt > SEARCH_TTL_MS) {
+        dbRequest('searches', 'readwrite', store => store.delete(record.key));
+        return null;
+    }
+    return record;
+}
+
+// Only analysed papers are stored, so a failed summary is fetched again next time
+function storeSearch(query, papers) {
+    const complete = papers.filter(paper => paper.summary && !paper.summary.fallback && !paper.fallback);
+    if (!complete.length) return;
+    return dbRequest('searches', 'readwrite', store => store.put({ key: queryKey(query), query, papers: complete, savedAt: Date.now() }));
+}
+
+function storeLiked(paper) {
+    if (!paper?.url) return;
+    return dbRequest('liked', 'readwrite', store => store.put({ url: paper.url, query: state.currentQuery, paper, savedAt: Date.now() }));
+}
+
+function clearLiked() {
+    return dbRequest('liked', 'readwrite', store => store.clear());
+}
+
+// Liked papers that have not expired, oldest first; expired ones are deleted
+async function loadLiked() {
+    const records = await dbRequest('liked', 'readonly', store => store.getAll()) || [];
+    const cutoff = Date.now() - LIKED_TTL_MS;
+    const expired = records.filter(record => record.savedAt < cutoff);
+    if (expired.length) {
+        dbRequest('liked', 'readwrite', store => { expired.forEach(record => store.delete(record.url)); });
+    }
+    return records.filter(record => record.savedAt >= cutoff).sort((a, b) => a.savedAt - b.savedAt);
+}
+
+// User id sent as X-User-Id: labels this browser's usage and owns its deep search jobs
+// (per-user limits follow it only where the backend trusts the header)
+let userIdPromise = null;
+
+function newUserId() {
+    if (window.crypto?.randomUUID) return crypto.randomUUID();
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
+// Stable per browser; only per page load where IndexedDB is unavailable
+function getUserId() {
+    if (!userIdPromise) {
+        userIdPromise = (async () => {
+            const record = await dbRequest('meta', 'readonly', store => store.get('userId'));
+            if (record?.value) return record.value;
+            const userId = newUserId();
+            await dbRequest('meta', 'readwrite', store => store.add({ key: 'userId', value: userId }));
+            // Another tab may have stored its id first
+            const stored = await dbRequest('meta', 'readonly', store => store.get('userId'));
+            return stored?.value || userId;
+        })();
+    }
+    return userIdPromise;
+}
+
+// fetch() against the backend as this browser's user
+async function apiFetch(path, options = {}) {
+    const headers = { ...(options.headers || {}), 'X-User-Id': await getUserId() };
+    return fetch(`${API_BASE_URL}${path}`, { ...options, headers });
+}
+
 // API Functions
 async function searchPapers(query) {
-    const response = await fetch(`${API_BASE_URL}/search`, {
+    const response = await apiFetch(`/search`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ query })
@@ -71,8 +205,87 @@ async function searchPapers(query) {
     return await response.json();
 }
 
+// Error for a stream that could not be read (no streaming support, or the connection broke);
+// only these are worth retrying on the non-streaming endpoint
+function streamUnavailable(message) {
+    const error = new Error(message);
+    error.streamUnavailable = true;
+    return error;
+}
+
+// Streams /search/stream (NDJSON) and calls onEvent for each event as it arrives:
+// first the raw paper list, then each paper as soon as its summary is ready.
+// An HTTP error status is thrown with the backend's detail, since /search would answer the same.
+async function searchPapersStream(query, onEvent) {
+    let response;
+    try {
+        response = await apiFetch(`/search/stream`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ query })
+        });
+    } catch (error) {
+        throw streamUnavailable(`Search stream failed: ${error.message}`);
+    }
+
+    if (!response.ok) {
+        const body = await response.json().catch(() => ({}));
+        const error = new Error(body.detail || 'Failed to search papers');
+        error.status = response.status;
+        throw error;
+    }
+    if (!response.body) {
+        throw streamUnavailable('Streaming is not supported');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        let chunk;
+        try {
+            chunk = await reader.read();
+        } catch (error) {
+            throw streamUnavailable(`Search stream broke: ${error.message}`);
+        }
+        const { value, done } = chunk;
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.filter(line => line.trim()).forEach(line => onEvent(JSON.parse(line)));
+    }
+    if (buffer.trim()) onEvent(JSON.parse(buffer));
+}
+
+// Deep search job (/jobs), used to prefetch more cards for the current query
+async function startDeepSearch(query, maxPapers, excludeUrls) {
+    const response = await apiFetch(`/jobs`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ query, max_papers: maxPapers, exclude_urls: excludeUrls })
+    });
+
+    if (!response.ok) {
+        throw new Error('Failed to start deep search');
+    }
+
+    return await response.json();
+}
+
+// Job status plus the papers finished after the first `since`
+async function getDeepSearch(jobId, since) {
+    const response = await apiFetch(`/jobs/${jobId}?since=${since}`);
+
+    if (!response.ok) {
+        throw new Error('Failed to fetch deep search');
+    }
+
+    return await response.json();
+}
+
 async function generateConclusion(papers) {
-    const response = await fetch(`${API_BASE_URL}/generate_conclusion`, {
+    const response = await apiFetch(`/generate_conclusion`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ papers })
@@ -85,18 +298,24 @@ async function generateConclusion(papers) {
     return await response.json();
 }
 
-async function generateBibliography(papers) {
-    const response = await fetch(`${API_BASE_URL}/generate_bibliography`, {
+// File extension per bibliography format, for when Content-Disposition is not readable
+const BIBLIOGRAPHY_EXTENSIONS = { harvard: 'txt', apa: 'txt', bibtex: 'bib', ris: 'ris' };
+
+// Bibliography as a file (streamed by the backend) in the chosen format
+async function generateBibliography(papers, format = 'harvard') {
+    const response = await apiFetch(`/generate_bibliography/stream`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ papers })
+        body: JSON.stringify({ papers, format })
     });
 
     if (!response.ok) {
         throw new Error('Failed to generate bibliography');
     }
 
-    return await response.json();
+    const disposition = response.headers.get('Content-Disposition') || '';
+    const extension = (disposition.match(/\.(\w+)"?$/) || [null, BIBLIOGRAPHY_EXTENSIONS[format] || 'txt'])[1];
+    return { blob: await response.blob(), extension };
 }
 
 // Card Functions
@@ -107,11 +326,32 @@ function createCard(paper, index) {
     card.style.zIndex = state.papers.length - index;
     card.style.display = index === state.currentIndex ? 'block' : 'none';
 
+    renderCard(card, paper);
+    addSwipeListeners(card);
+    return card;
+}
+
+// Fill (or refill, once its summary arrives) a card's content
+// Fallback papers were never analysed, so their scores are not shown as numbers
+function formatScore(paper, field) {
+    if (paper.fallback || paper.summary?.fallback) return '—';
+    const score = paper.summary?.[field];
+    return score == null ? '…' : `${score}%`;
+}
+
+// Label shown next to the source for papers the backend could not analyse
+function fallbackLabel(paper) {
+    if (paper.summary?.fallback) return ' · summary unavailable';
+    if (paper.fallback) return ' · example result';
+    return '';
+}
+
+function renderCard(card, paper) {
     // Get the best available description
     const description = paper.summary?.summary || paper.abstract || paper.snippet || 'This paper explores key concepts and findings in the research area.';
 
     card.innerHTML = `
-        <div class="card-source">${extractDomain(paper.url)}</div>
+        <div class="card-source">${extractDomain(paper.url)}${fallbackLabel(paper)}</div>
         <h2 class="card-title">${paper.title}</h2>
         <p class="card-snippet">${description}</p>
 
@@ -133,11 +373,11 @@ function createCard(paper, index) {
         <div class="card-scores">
             <div class="score-badge">
                 <div class="score-label">Relevance</div>
-                <div class="score-value">${paper.summary?.relevance_score || 85}%</div>
+                <div class="score-value">${formatScore(paper, 'relevance_score')}</div>
             </div>
             <div class="score-badge">
                 <div class="score-label">Authenticity</div>
-                <div class="score-value">${paper.summary?.authenticity_score || 90}%</div>
+                <div class="score-value">${formatScore(paper, 'authenticity_score')}</div>
             </div>
         </div>
 
@@ -145,9 +385,102 @@ function createCard(paper, index) {
             Read Full Paper
         </a>
     `;
+}
 
-    addSwipeListeners(card);
-    return card;
+// Replace a streamed placeholder with the summarized paper
+function updatePaper(index, paper) {
+    if (!state.papers[index]) return;
+    // Mutate in place so a paper already saved picks up its summary too
+    Object.assign(state.papers[index], paper);
+    const card = cardStack.querySelector(`.paper-card[data-index="${index}"]`);
+    if (card) renderCard(card, state.papers[index]);
+    if (state.savedPapers.includes(state.papers[index])) storeLiked(state.papers[index]);
+}
+
+// Add cards to the end of the deck, skipping papers it already has
+function appendPapers(papers) {
+    const waiting = state.currentIndex >= state.papers.length;
+    const seen = new Set(state.papers.map(paper => paper.url));
+    let added = 0;
+    papers.filter(paper => paper.url && !seen.has(paper.url)).forEach(paper => {
+        seen.add(paper.url);
+        state.papers.push(paper);
+        cardStack.appendChild(createCard(paper, state.papers.length - 1));
+        added++;
+    });
+    if (!added) return 0;
+    updateCounter();
+    if (waiting) {
+        hideDeckEnd();
+        updateCardVisibility();
+    }
+    return added;
+}
+
+// Shown in place of a card when the deck ran out while a prefetch is still running.
+// The user can keep waiting for more cards or go on to the results.
+function showDeckEnd() {
+    if (cardStack.querySelector('.deck-end')) return;
+    const end = document.createElement('div');
+    end.className = 'deck-end';
+    end.innerHTML = `
+        <div class="spinner"></div>
+        <p>Finding more papers...</p>
+        <button class="btn-secondary">See results</button>
+    `;
+    end.querySelector('button').addEventListener('click', () => {
+        cancelPrefetch();
+        showResults();
+    });
+    cardStack.appendChild(end);
+}
+
+function hideDeckEnd() {
+    cardStack.querySelector('.deck-end')?.remove();
+}
+
+// Once the user reaches the end of the deck, start a deep search for the next batch of
+// unseen papers and poll it for new cards. The job is told which papers the deck already
+// has, so it only spends its budget on new ones.
+async function maybePrefetch() {
+    if ((state.prefetch && !state.prefetch.done) || !state.currentQuery) return;
+
+    const prefetch = state.prefetch = { jobId: null, received: 0, added: 0, done: false };
+    try {
+        const job = await startDeepSearch(
+            state.currentQuery, PREFETCH_BATCH, state.papers.map(paper => paper.url)
+        );
+        prefetch.jobId = job.job_id;
+        while (state.prefetch === prefetch) {
+            const update = await getDeepSearch(job.job_id, prefetch.received);
+            if (state.prefetch !== prefetch) break;
+            prefetch.received += update.papers.length;
+            prefetch.added += appendPapers(update.papers);
+            if (!['queued', 'planning', 'running'].includes(update.status)) break;
+            await new Promise(resolve => setTimeout(resolve, PREFETCH_POLL_MS));
+        }
+    } catch (error) {
+        console.error('Prefetch failed:', error);
+    }
+    prefetch.done = true;
+
+    if (state.prefetch !== prefetch) return;
+    storeSearch(state.currentQuery, state.papers);
+    // The user reached the end while waiting and no new cards came
+    if (state.currentIndex >= state.papers.length && swipePage.classList.contains('active')) {
+        hideDeckEnd();
+        showResults();
+    }
+}
+
+// Stop topping up a deck the user has left
+function cancelPrefetch() {
+    const prefetch = state.prefetch;
+    state.prefetch = null;
+    hideDeckEnd();
+    if (prefetch?.jobId && !prefetch.done) {
+        apiFetch(`/jobs/${prefetch.jobId}`, { method: 'DELETE' }).catch(() => {});
+    }
 }
 
 function extractDomain(url) {
@@ -236,6 +569,7 @@ function swipeRight() {
     const card = document.querySelector(`.paper-card[data-index="${state.currentIndex}"]`);
     if (!card) return;
     state.savedPapers.push(state.papers[state.currentIndex]);
+    storeLiked(state.papers[state.currentIndex]);
     card.classList.add('swipe-right');
     setTimeout(() => { nextCard(); }, 400);
 }
@@ -243,6 +577,13 @@ function swipeRight() {
 function nextCard() {
     state.currentIndex++;
     if (state.currentIndex >= state.papers.length) {
+        // Out of cards: fetch the next batch, unless the last one found nothing new
+        if (!state.prefetch || (state.prefetch.done && state.prefetch.added)) maybePrefetch();
+        // More cards are on their way: offer to wait for them instead of ending the deck
+        if (state.prefetch && !state.prefetch.done) {
+            showDeckEnd();
+            return;
+        }
         showResults();
     } else {
         updateCounter();
@@ -268,7 +609,7 @@ function showResults() {
             <div class="paper-header">
                 <div class="paper-info">
                     <h3>${index + 1}. ${paper.title}</h3>
-                    <p>${extractDomain(paper.url)} • Relevance: ${paper.summary?.relevance_score || 85}%</p>
+                    <p>${extractDomain(paper.url)} • Relevance: ${formatScore(paper, 'relevance_score')}</p>
                 </div>
                 <div class="paper-actions">
                     <button class="btn-toggle-details" data-index="${index}">
@@ -303,11 +644,11 @@ function showResults() {
                     <div class="detail-scores">
                         <div class="score-badge">
                             <div class="score-label">Relevance</div>
-                            <div class="score-value">${paper.summary?.relevance_score || 85}%</div>
+                            <div class="score-value">${formatScore(paper, 'relevance_score')}</div>
                         </div>
                         <div class="score-badge">
                             <div class="score-label">Authenticity</div>
-                            <div class="score-value">${paper.summary?.authenticity_score || 90}%</div>
+                            <div class="score-value">${formatScore(paper, 'authenticity_score')}</div>
                         </div>
                     </div>
                 </div>
@@ -355,8 +696,8 @@ function exportAsCSV() {
             `"${(paper.title || '').replace(/"/g, '""')}"`,
             `"${paper.url || ''}"`,
             `"${extractDomain(paper.url)}"`,
-            paper.summary?.relevance_score || 85,
-            paper.summary?.authenticity_score || 90,
+            paper.summary?.fallback ? '' : (paper.summary?.relevance_score ?? ''),
+            paper.summary?.fallback ? '' : (paper.summary?.authenticity_score ?? ''),
             `"${(paper.summary?.key_findings || '').replace(/"/g, '""')}"`,
             `"${(paper.summary?.methodology || '').replace(/"/g, '""')}"`,
             `"${(paper.summary?.limitations || '').replace(/"/g, '""')}"`
@@ -382,14 +723,13 @@ async function createBibliography() {
 
     showLoading('Generating bibliography...');
     try {
-        const result = await generateBibliography(state.savedPapers);
+        const result = await generateBibliography(state.savedPapers, bibliographyFormat?.value || 'harvard');
         
-        // Create a downloadable text file
-        const blob = new Blob([result.bibliography], { type: 'text/plain;charset=utf-8;' });
-        const url = URL.createObjectURL(blob);
+        // Download the file as the backend formatted it
+        const url = URL.createObjectURL(result.blob);
         const link = document.createElement('a');
         link.href = url;
-        link.download = `scholarswipe-bibliography-${Date.now()}.txt`;
+        link.download = `scholarswipe-bibliography-${Date.now()}.${result.extension}`;
         link.click();
         URL.revokeObjectURL(url);
         
@@ -457,37 +797,118 @@ searchBtn.addEventListener('click', async () => {
     const query = searchInput.value.trim();
     if (!query) return alert('Please enter a research question');
 
-    showLoading('Searching research papers...');
     state.currentQuery = query;
+    cancelPrefetch();
+
+    // Ignore late events from a previous search's stream
+    const searchId = ++state.searchId;
+    let deckShown = false;
+
+    // A repeated query is served from the local store, and refreshed in the background once stale
+    const stored = await getStoredSearch(query);
+    if (searchId !== state.searchId) return;
+    if (stored) {
+        showDeck(query, stored.papers);
+        if (Date.now() - stored.savedAt > SEARCH_STALE_MS) revalidateSearch(query, searchId);
+        return;
+    }
 
-    try {
-        const results = await searchPapers(query);
-        state.papers = results.papers || [];
-        state.currentIndex = 0;
-        state.savedPapers = [];
-
-        if (!state.papers.length) throw new Error('No papers found');
-
-        queryDisplay.textContent = query;
-        updateCounter();
+    showLoading('Searching research papers...');
 
-        cardStack.innerHTML = '';
-        state.papers.forEach((paper, i) => {
-            const card = createCard(paper, i);
-            cardStack.appendChild(card);
+    try {
+        await searchPapersStream(query, event => {
+            if (searchId !== state.searchId) return;
+            if (event.type === 'papers') {
+                showDeck(query, event.papers || []);
+                deckShown = true;
+                hideLoading();
+            } else if (event.type === 'paper') {
+                updatePaper(event.index, event.paper);
+            } else if (event.type === 'error') {
+                console.error('Search stream error:', event.detail);
+            }
         });
-
-        showPage(swipePage);
+        if (!deckShown) throw new Error('No papers found');
+        if (searchId === state.searchId) storeSearch(query, state.papers);
     } catch (error) {
-        alert('Failed to search papers. Make sure the backend is running!');
         console.error(error);
+        if (!deckShown && searchId === state.searchId && error.streamUnavailable) {
+            // Fall back to the non-streaming endpoint
+            try {
+                const results = await searchPapers(query);
+                showDeck(query, results.papers || []);
+                storeSearch(query, state.papers);
+            } catch (fallbackError) {
+                alert('Failed to search papers. Make sure the backend is running!');
+                console.error(fallbackError);
+            }
+        } else if (!deckShown && searchId === state.searchId) {
+            alert(`Failed to search papers: ${error.message}`);
+        }
     } finally {
         hideLoading();
     }
 });
 
+// Refetch a query served from the local store: refresh the cards not yet reached,
+// add any new papers to the end of the deck and store the fresh results
+async function revalidateSearch(query, searchId) {
+    let papers = [];
+    try {
+        await searchPapersStream(query, event => {
+            if (event.type === 'papers') {
+                papers = event.papers || [];
+            } else if (event.type === 'paper') {
+                papers[event.index] = event.paper;
+                if (searchId !== state.searchId) return;
+                const index = state.papers.findIndex(paper => paper.url === event.paper.url);
+                if (index > state.currentIndex) updatePaper(index, event.paper);
+            }
+        });
+        storeSearch(query, papers);
+        if (searchId === state.searchId) appendPapers(papers.filter(paper => paper.summary));
+    } catch (error) {
+        console.error('Background refresh failed:', error);
+    }
+}
+
+function showDeck(query, papers) {
+    state.papers = papers;
+    state.currentIndex = 0;
+    state.savedPapers = [];
+    resumeBtn.style.display = 'none';
+
+    if (!state.papers.length) throw new Error('No papers found');
+
+    queryDisplay.textContent = query;
+    updateCounter();
+
+    cardStack.innerHTML = '';
+    state.papers.forEach((paper, i) => {
+        const card = createCard(paper, i);
+        cardStack.appendChild(card);
+    });
+
+    showPage(swipePage);
+}
+
+// Liked papers from an earlier visit can be reviewed again without searching
+async function restoreLiked() {
+    const records = await loadLiked();
+    if (!records.length || state.savedPapers.length || state.papers.length) return;
+    state.savedPapers = records.map(record => record.paper);
+    state.currentQuery = records[records.length - 1].query || '';
+    resumeBtn.textContent = `Review ${records.length} saved paper${records.length > 1 ? 's' : ''}`;
+    resumeBtn.style.display = '';
+}
+
 searchInput.addEventListener('keypress', e => { if (e.key === 'Enter') searchBtn.click(); });
-backBtn.addEventListener('click', () => { if (confirm('Go back? Progress will be lost.')) showPage(searchPage); });
+backBtn.addEventListener('click', () => {
+    if (!confirm('Go back? Progress will be lost.')) return;
+    cancelPrefetch();
+    showPage(searchPage);
+});
+resumeBtn.addEventListener('click', showResults);
 discardBtn.addEventListener('click', swipeLeft);
 keepBtn.addEventListener('click', swipeRight);
 
@@ -503,11 +924,16 @@ generateSummaryBtn.addEventListener('click', generateOverallSummary);
 
 newSearchBtn.addEventListener('click', () => { 
     searchInput.value = ''; 
+    cancelPrefetch();
     state.savedPapers = [];
     state.papers = [];
     state.currentIndex = 0;
+    clearLiked();
+    resumeBtn.style.display = 'none';
     showPage(searchPage); 
 });
 
+restoreLiked();
+
 
 console.log('ScholarSwipe initialized! Make sure your backend is running at:', API_BASE_URL);